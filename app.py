@@ -1,51 +1,37 @@
 import streamlit as st
 import os
-import uuid
 import re
-import pandas as pd
-from PIL import Image
-import keras
-from keras import metrics
-from tensorflow.keras.models import model_from_json
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
+import time
+import uuid
 import base64
+from concurrent.futures import wait
 
+from model_loader import PREWARM, start_prewarm
+from inference_backends import get_backend
+from prediction_jobs import get_job_manager, image_hash
+from explain import EXPLAIN_BY_DEFAULT, overlay_heatmap
+from ingest import decode_upload, InvalidImageError
+from user_store import get_user_store
+from telemetry import DEBUG_METRICS, render_prometheus, span, stage_summary, \
+    start_metrics_file_writer, start_metrics_server, touch_session
 
-# Register the custom metric function as serializable
-@keras.saving.register_keras_serializable()
-def top_2_accuracy(y_true, y_pred):
-    return metrics.top_k_categorical_accuracy(y_true, y_pred, k=2)
 
+# Seconds between checks on running prediction jobs
+JOB_POLL_SECONDS = 0.5
+# How long a run waits for its jobs before showing progress; cache hits finish well within it
+JOB_WAIT_SECONDS = 0.25
 
-@keras.saving.register_keras_serializable()
-def top_3_accuracy(y_true, y_pred):
-    return metrics.top_k_categorical_accuracy(y_true, y_pred, k=3)
+# Path for the home page background image
+HOME_BG_PATH = r'F:\Skin-LesionDetection-main\Skin\Skin\skinbg.jpg'
 
+# The model is loaded on the first visit to "Check Disease"; optionally start
+# loading it in the background as soon as the app boots
+if PREWARM:
+    start_prewarm(lambda: get_backend().load())
 
-# Paths for model files
-# Updated paths for model files
-MODEL_JSON_PATH = r'F:\Skin-LesionDetection-main\Skin\Skin\model.json'
-MODEL_WEIGHTS_PATH = r'F:\Skin-LesionDetection-main\Skin\Skin\model.h5'
-HOME_BG_PATH = r'F:\Skin-LesionDetection-main\Skin\Skin\skinbg.jpg'
-# Path for the Excel file to store user data
-USER_DATA_PATH = r'F:\Skin-LesionDetection-main\Skin\Skin\user_data.xlsx'
-
-# Load the model
-try:
-    with open(MODEL_JSON_PATH, 'r') as j_file:
-        loaded_json_model = j_file.read()
-    model = model_from_json(loaded_json_model, custom_objects={
-                            'top_2_accuracy': top_2_accuracy, 'top_3_accuracy': top_3_accuracy})
-    model.load_weights(MODEL_WEIGHTS_PATH)
-except Exception as e:
-    st.error(f"Failed to load model: {e}")
-    st.stop()
-
-# Prediction classes
-classes = [
-    'Actinic Keratosis', 'Basal Cell Carcinoma', 'Benign Keratosis',
-    'Dermatofibroma', 'Melanoma', 'Melanocytic Nevi', 'Vascular naevus',
-]
+# Export metrics when SKIN_METRICS_PORT or SKIN_METRICS_FILE is set (once per process)
+start_metrics_server()
+start_metrics_file_writer()
 
 
 # Utility functions
@@ -57,47 +43,14 @@ def is_strong_password(password):
     return len(password) >= 8 and re.search(r"[A-Z]", password) and re.search(r"[0-9]", password) and re.search(r"[@$!%*?&#]", password)
 
 
-def predict_image(image_path, model, threshold=0.5):
-    img = load_img(image_path, target_size=(224, 224))
-    img = img_to_array(img)
-    img = img.reshape(1, 224, 224, 3)
-    img = img.astype('float32') / 255.0
-    result = model.predict(img)
-
-    predictions = {result[0][i]: classes[i] for i in range(len(result[0]))}
-    sorted_results = sorted(predictions.items(),
-                            key=lambda x: x[0], reverse=True)
-
-    top_prob = sorted_results[0][0]
-    top_class = sorted_results[0][1]
-
-    if top_prob < threshold:
-        top_classes = [item[1] for item in sorted_results[:3]]
-
-    top_classes = [item[1] for item in sorted_results[:3]]
-    top_probs = [(item[0] * 100).round(2) for item in sorted_results[:3]]
-
-    return top_classes, top_probs, top_class, top_prob
-
-
 # Initialize session state
 if 'page' not in st.session_state:
     st.session_state.page = "Home"
 if 'user' not in st.session_state:
     st.session_state.user = None
-
-
-# Function to check if user data exists
-def load_user_data():
-    if os.path.exists(USER_DATA_PATH):
-        return pd.read_excel(USER_DATA_PATH)
-    else:
-        return pd.DataFrame(columns=['email', 'name', 'password'])
-
-
-# Function to save user data
-def save_user_data(df):
-    df.to_excel(USER_DATA_PATH, index=False)
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+touch_session(st.session_state.session_id)
 
 
 # Function to navigate to a different page
@@ -140,8 +93,6 @@ def sign_up_page():
     password = st.text_input("Password", type="password")
     confirm_password = st.text_input("Confirm Password", type="password")
 
-    user_data = load_user_data()
-
     if st.button("Sign Up"):
         if not name.isalpha():
             st.error("Name should contain only alphabetic characters.")
@@ -151,13 +102,9 @@ def sign_up_page():
             st.error("Password is not strong enough.")
         elif password != confirm_password:
             st.error("Passwords do not match.")
-        elif email in user_data['email'].values:
+        elif not get_user_store().add_user(email, name, password):
             st.error("Email is already registered.")
         else:
-            new_user = pd.DataFrame([[email, name, password]], columns=[
-                                    'email', 'name', 'password'])
-            user_data = pd.concat([user_data, new_user], ignore_index=True)
-            save_user_data(user_data)
             st.success("Account created successfully!")
             navigate_to("Log In")
 
@@ -178,12 +125,10 @@ def log_in_page():
     email = st.text_input("Email")
     password = st.text_input("Password", type="password")
 
-    user_data = load_user_data()
-
     if st.button("Log In"):
-        if email in user_data['email'].values and user_data.loc[user_data['email'] == email, 'password'].values[0] == password:
-            st.session_state.user = user_data.loc[user_data['email']
-                                                  == email, 'name'].values[0]
+        user = get_user_store().get_user(email)
+        if user is not None and user['password'] == password:
+            st.session_state.user = user['name']
             navigate_to("Home")
         else:
             st.error("Invalid email or password.")
@@ -238,48 +183,151 @@ def check_disease_page():
     if st.button("Home"):
         navigate_to("Home")
 
-    uploaded_file = st.file_uploader("Choose an image file", type=[
-                                     'jpg', 'jpeg', 'png', 'jfif'])
-    if uploaded_file:
-        # Save the uploaded file temporarily
-        unique_filename = str(uuid.uuid4()) + ".jpg"
-        temp_file_path = os.path.join("temp", unique_filename)
-        os.makedirs("temp", exist_ok=True)
-        with open(temp_file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-
-        # Use columns for layout
-        col1, col2 = st.columns(2)
-
-        # Display the uploaded image on the left side
-        with col1:
-            st.write("### Uploaded Image")
-            image = Image.open(temp_file_path)
-            st.image(image, caption="Uploaded Image", use_container_width=True)
-
-        # Predict button and results on the right side
-        with col2:
-            if st.button("Predict"):
-                with st.spinner("Predicting..."):
-                    top_classes, top_probs, top_class, top_prob = predict_image(
-                        temp_file_path, model)
-
-                # Display results
-                st.success("Prediction Completed!")
-
+    # Load the model (cached per process, reloaded only if the model files change)
+    try:
+        with st.spinner("Loading model..."):
+            get_backend().load()
+    except Exception as e:
+        st.error(f"Failed to load model: {e}")
+        st.stop()
+
+    uploaded_files = st.file_uploader("Choose image files", type=[
+                                      'jpg', 'jpeg', 'png', 'jfif'], accept_multiple_files=True)
+    if uploaded_files:
+        # Decode each upload once per session, in memory, for both display and inference
+        decoded = st.session_state.setdefault('decoded_uploads', {})
+        names, hashes, images_bytes, thumbnails, model_inputs = [], [], [], [], []
+        for uploaded_file in uploaded_files:
+            with span('upload_read'):
+                image_bytes = uploaded_file.getbuffer()
+            hash_ = image_hash(image_bytes)
+            if hash_ not in decoded:
+                try:
+                    with span('decode'):
+                        decoded[hash_] = decode_upload(image_bytes)
+                except InvalidImageError as e:
+                    st.error(f"{uploaded_file.name}: {e}")
+                    continue
+            thumbnail, model_input = decoded[hash_]
+            names.append(uploaded_file.name)
+            hashes.append(hash_)
+            images_bytes.append(image_bytes)
+            thumbnails.append(thumbnail)
+            model_inputs.append(model_input)
+        # Forget images and results for files that are no longer uploaded
+        results = st.session_state.setdefault('prediction_results', {})
+        for store in (decoded, results):
+            for hash_ in set(store) - set(hashes):
+                del store[hash_]
+        if not names:
+            return
+
+        # Display the uploaded images
+        with span('render'):
+            st.write("### Uploaded Images")
+            image_cols = st.columns(min(len(thumbnails), 4))
+            for i, thumbnail in enumerate(thumbnails):
+                with image_cols[i % len(image_cols)]:
+                    st.image(thumbnail, caption=names[i],
+                             use_container_width=True)
+
+        # Grad-CAM heatmaps need the Keras backend
+        explain = get_backend().name == 'keras' and st.checkbox(
+            "Show what drove the prediction", value=EXPLAIN_BY_DEFAULT)
+
+        # Predict in background jobs so reruns pick up the running or finished work
+        jobs = get_job_manager()
+        session_id = st.session_state.session_id
+        if st.button("Predict"):
+            for hash_, image_bytes, model_input in zip(hashes, images_bytes, model_inputs):
+                if hash_ not in results or (explain and results[hash_][2] is None):
+                    results.pop(hash_, None)
+                    jobs.submit(session_id, bytes(image_bytes), model_input, explain)
+            st.session_state.predict_requested = True
+        if not st.session_state.get('predict_requested'):
+            return
+
+        # Move finished jobs into session state
+        active = {hash_: jobs.get(session_id, hash_, explain)
+                  for hash_ in hashes if hash_ not in results}
+        wait([job.future for job in active.values() if job is not None],
+             timeout=JOB_WAIT_SECONDS)
+        pending = []
+        for name, hash_ in zip(names, hashes):
+            job = active.get(hash_)
+            if job is None:
+                continue
+            if job.status == 'done':
+                results[hash_] = jobs.collect(session_id, hash_, explain).result()
+            elif job.status == 'failed':
+                jobs.collect(session_id, hash_, explain)
+                st.error(f"{name}: prediction failed: {job.future.exception()}")
+            else:
+                pending.append(hash_)
+
+        if pending:
+            finished = len(hashes) - len(pending)
+            st.progress(finished / len(hashes),
+                        text=f"Predicting... {finished}/{len(hashes)} images")
+            if st.button("Cancel"):
+                jobs.cancel(session_id, pending)
+                st.session_state.predict_requested = False
+                st.rerun()
+        elif any(hash_ in results for hash_ in hashes):
+            st.success("Prediction Completed!")
+
+        # Display results
+        with span('render'):
+            for name, hash_, thumbnail in zip(names, hashes, thumbnails):
+                if hash_ not in results:
+                    continue
+                (top_classes, top_probs, top_class, top_prob), similar, heatmaps = results[hash_]
+                st.write(f"## {name}")
                 # Split the space for predictions and final classification
                 pred_col1, pred_col2 = st.columns([2, 1])
                 with pred_col1:
                     st.write("### Top Predictions")
-                    for i in range(len(top_classes)):
-                        st.write(f"*{top_classes[i]}*: {top_probs[i]}%")
+                    for c, p in zip(top_classes, top_probs):
+                        st.write(f"*{c}*: {p}%")
                 with pred_col2:
                     st.write("### Final Classification")
                     st.write(
                         f"*Predicted Class*: {top_class} with {top_prob:.2f}%")
 
-        # Clean up temporary file
-        os.remove(temp_file_path)
+                if explain and heatmaps is not None:
+                    show_heatmaps(thumbnail, heatmaps, top_classes)
+                if similar is not None:
+                    show_similar_cases(similar)
+
+        # Poll the running jobs
+        if pending:
+            time.sleep(JOB_POLL_SECONDS)
+            st.rerun()
+
+
+# Function to show Grad-CAM heatmaps over the upload's thumbnail, one per explained class
+def show_heatmaps(thumbnail, heatmaps, top_classes):
+    st.write("### What Drove the Prediction")
+    cols = st.columns(len(heatmaps))
+    for col, heatmap, class_name in zip(cols, heatmaps, top_classes):
+        with col:
+            st.image(overlay_heatmap(thumbnail, heatmap), caption=class_name,
+                     use_container_width=True)
+
+
+# Function to show previously diagnosed images similar to an upload
+def show_similar_cases(matches):
+    if not matches:
+        return
+    st.write("### Similar Diagnosed Cases")
+    cols = st.columns(len(matches))
+    for col, (similarity, meta) in zip(cols, matches):
+        with col:
+            caption = f"{meta.get('label') or 'Unlabeled'} ({similarity:.2f})"
+            if os.path.exists(meta['path']):
+                st.image(meta['path'], caption=caption, use_container_width=True)
+            else:
+                st.write(caption)
 
 
 # Know About Diseases Page
@@ -474,6 +522,14 @@ def know_about_diseases_page():
             st.write(f"- {solution}")
 
 
+# Debug panel with the hot-path metrics, enabled with SKIN_DEBUG_METRICS=1
+def metrics_debug_panel():
+    with st.sidebar.expander("Performance metrics"):
+        for stage, (count, mean) in stage_summary().items():
+            st.write(f"*{stage}*: {mean * 1000:.1f} ms mean over {count}")
+        st.code(render_prometheus(), language="text")
+
+
 # Render the appropriate page based on the session state
 if st.session_state.page == "Sign Up":
     sign_up_page()
@@ -485,3 +541,6 @@ elif st.session_state.page == "Check Disease":
     check_disease_page()
 elif st.session_state.page == "Know About Diseases":
     know_about_diseases_page()
+
+if DEBUG_METRICS:
+    metrics_debug_panel()
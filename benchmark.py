@@ -0,0 +1,193 @@
+"""Time each stage of the preprocessing and inference hot path.
+
+Usage:
+    python benchmark.py [--batch-sizes 1,8,32,128] [--iterations 20] [--output bench.json]
+                        [--compare previous.json]
+
+Stages: decode, resize, array conversion + normalisation, the whole path
+for files (``preprocess_image``), the in-memory upload path
+(``decode_upload``), the forward pass (``predict_on_batch``, as the
+inference backend runs it) and the top-k post-processing.
+Each is reported as p50/p95/p99 latency and images/sec.
+Synthetic JPEGs are generated, and a stand-in model with random weights is
+used when the real ``model.h5`` is missing, so the suite runs offline.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from model_loader import IMAGE_SIZE, INPUT_SHAPE, MODEL_JSON_PATH, MODEL_WEIGHTS_PATH, \
+    build_stand_in_model, load_model
+from inference import classes, preprocess_image, top_k_predictions
+from ingest import decode_upload
+
+
+DEFAULT_BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128]
+# Width x height of the synthetic images: HAM10000 dermoscopy and a 12 MP phone photo
+DEFAULT_IMAGE_SIZES = ['600x450', '4032x3024']
+
+
+# Function to write synthetic JPEGs that compress like real photos
+def make_images(directory, sizes, count=4):
+    rng = np.random.default_rng(0)
+    paths = []
+    for size in sizes:
+        width, height = map(int, size.split('x'))
+        for i in range(count):
+            # Smooth noise compresses like a photo; pure noise would inflate decode time
+            small = rng.integers(0, 256, (height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+            img = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+            path = os.path.join(directory, f'{size}_{i}.jpg')
+            img.save(path, 'JPEG', quality=90)
+            paths.append(path)
+    return paths
+
+
+# Function to time fn() repeatedly and summarise the latencies
+def time_stage(fn, iterations, items_per_call=1, warmup=2):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'images_per_sec': float(items_per_call * 1000.0 / latencies.mean()),
+        'iterations': iterations,
+    }
+
+
+def benchmark_preprocessing(paths, iterations):
+    results = {}
+    for path in paths:
+        size = os.path.basename(path).split('_')[0]
+        if size in results:
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        # Image.open decodes lazily, so force the decode with load()
+        decoded = Image.open(path).convert('RGB')
+        resized = decoded.resize(IMAGE_SIZE, Image.NEAREST)
+        results[size] = {
+            'decode': time_stage(lambda: Image.open(path).load(), iterations),
+            'resize': time_stage(lambda: decoded.resize(IMAGE_SIZE, Image.NEAREST), iterations),
+            'to_array': time_stage(
+                lambda: np.asarray(resized).reshape(INPUT_SHAPE).astype('float32') / 255.0,
+                iterations),
+            'preprocess_total': time_stage(lambda: preprocess_image(path), iterations),
+            'decode_upload': time_stage(lambda: decode_upload(data), iterations),
+        }
+    return results
+
+
+def benchmark_model(model, batch_sizes, iterations):
+    rng = np.random.default_rng(0)
+    results = {}
+    for batch_size in batch_sizes:
+        batch = rng.random((batch_size,) + INPUT_SHAPE, dtype=np.float32)
+        probs = rng.dirichlet(np.ones(len(classes)), size=batch_size)
+        results[str(batch_size)] = {
+            'predict': time_stage(lambda: model.predict_on_batch(batch), iterations, batch_size),
+            'top_k': time_stage(lambda: top_k_predictions(probs, 3), iterations, batch_size),
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+# Function to print p50 changes against an earlier report
+def compare(report, previous):
+    def walk(new, old, prefix):
+        for key, value in new.items():
+            if key not in old or not isinstance(value, dict):
+                continue
+            if 'p50_ms' in value:
+                ratio = value['p50_ms'] / old[key]['p50_ms'] if old[key]['p50_ms'] else float('nan')
+                flag = '  <-- slower' if ratio > 1.10 else ''
+                print(f"  {prefix}{key}: {old[key]['p50_ms']:.2f} -> {value['p50_ms']:.2f} ms "
+                      f"({ratio:.2f}x){flag}")
+            else:
+                walk(value, old[key], f"{prefix}{key}/")
+
+    print(f"Compared with {previous.get('commit') or 'previous run'}:")
+    walk(report['results'], previous['results'], '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-sizes', default=','.join(map(str, DEFAULT_BATCH_SIZES)))
+    parser.add_argument('--image-sizes', default=','.join(DEFAULT_IMAGE_SIZES),
+                        help='comma-separated WIDTHxHEIGHT of synthetic images')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--stand-in', action='store_true',
+                        help='use the stand-in model even if model.h5 exists')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='earlier benchmark JSON to compare against')
+    args = parser.parse_args()
+
+    if not args.stand_in and os.path.exists(MODEL_WEIGHTS_PATH):
+        model, model_source = load_model(), 'model.h5'
+    else:
+        model = build_stand_in_model()
+        model_source = 'stand-in (model.json)' if os.path.exists(MODEL_JSON_PATH) else 'stand-in'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_images(tmp, args.image_sizes.split(','))
+        preprocessing = benchmark_preprocessing(paths, args.iterations)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    inference_results = benchmark_model(model, batch_sizes, args.iterations)
+
+    import tensorflow as tf
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                    'cpu_count': os.cpu_count(), 'python': platform.python_version(),
+                    'tensorflow': tf.__version__},
+        'model': model_source,
+        'results': {'preprocessing': preprocessing, 'inference': inference_results},
+    }
+
+    for size, stages in preprocessing.items():
+        print(f"Preprocessing {size}:")
+        for stage, r in stages.items():
+            print(f"  {stage:15s} p50 {r['p50_ms']:8.2f}  p95 {r['p95_ms']:8.2f}  "
+                  f"p99 {r['p99_ms']:8.2f} ms  {r['images_per_sec']:9.1f} img/s")
+    print(f"Inference ({model_source}):")
+    for batch_size, stages in inference_results.items():
+        for stage, r in stages.items():
+            print(f"  batch {batch_size:>4s} {stage:8s} p50 {r['p50_ms']:8.2f}  "
+                  f"p95 {r['p95_ms']:8.2f}  p99 {r['p99_ms']:8.2f} ms  "
+                  f"{r['images_per_sec']:9.1f} img/s")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
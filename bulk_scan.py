@@ -0,0 +1,204 @@
+"""Score a directory tree or list of images and stream top-3 predictions to a file.
+
+Usage:
+    python bulk_scan.py IMAGES_DIR_OR_LIST --output scores.csv [--batch-size 64] [--workers 8]
+    python bulk_scan.py IMAGES_DIR_OR_LIST --output scores.parquet
+
+``IMAGES_DIR_OR_LIST`` is a directory (walked recursively), a text file with
+one image path per line, or ``-`` for paths on stdin. Re-running with the
+same output resumes an interrupted run: the output doubles as the
+checkpoint, so images already scored are skipped, while rows recording a
+failure are dropped and those images retried. CSV output is appended batch
+by batch; Parquet output is a directory of part files of a few thousand
+rows, each written atomically, so a killed run loses at most one part. Rows use the same preprocessing and class order as
+``predict_image``, with probabilities in percent like the UI.
+"""
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+import time
+
+from inference import DEFAULT_BATCH_SIZE, iter_image_paths, iter_preprocessed_batches, \
+    top_k_predictions
+from inference_backends import get_backend
+
+
+COLUMNS = ['path', 'class1', 'prob1', 'class2', 'prob2', 'class3', 'prob3', 'error']
+# Rows buffered per Parquet part file; also the most a killed run can lose
+ROWS_PER_PART = 4096
+
+
+# Function to lazily list the images to score
+def iter_inputs(source):
+    if os.path.isdir(source):
+        yield from iter_image_paths(source)
+        return
+    f = sys.stdin if source == '-' else open(source)
+    with f:
+        for line in f:
+            if line.strip():
+                yield line.strip()
+
+
+def result_rows(paths, probs, failures):
+    rows = []
+    results = top_k_predictions(probs, 3) if paths else []
+    for path, (top_classes, top_probs, _, _) in zip(paths, results):
+        row = {'path': path, 'error': ''}
+        for i, (c, p) in enumerate(zip(top_classes, top_probs), start=1):
+            row[f'class{i}'] = c
+            row[f'prob{i}'] = round(float(p), 2)
+        rows.append(row)
+    for path, error in failures:
+        rows.append({'path': path, 'error': error})
+    return rows
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.path = path
+
+    def done_paths(self):
+        if not os.path.exists(self.path):
+            return set()
+        # Drop a partial last line left by an interrupted write
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                f.truncate(end)
+        with open(self.path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        scored = [row for row in rows if not row['error']]
+        # Rewrite without the failed rows so their images are retried
+        if len(scored) != len(rows):
+            with open(self.path + '.tmp', 'w', newline='') as f:
+                writer = csv.DictWriter(f, COLUMNS)
+                writer.writeheader()
+                writer.writerows(scored)
+            os.replace(self.path + '.tmp', self.path)
+        return {row['path'] for row in scored}
+
+    def __enter__(self):
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, COLUMNS)
+        if is_new:
+            self._writer.writeheader()
+        return self
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path, rows_per_file=ROWS_PER_PART):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            sys.exit("Parquet output needs pyarrow: pip install pyarrow")
+        self.path = path
+        self.rows_per_file = rows_per_file
+        self._rows = []
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def done_paths(self):
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        done = set()
+        for part in self._parts():
+            table = pq.read_table(part)
+            scored = table.filter(pc.equal(pc.fill_null(table.column('error'), ''), ''))
+            # Rewrite the part without its failed rows so their images are retried
+            if scored.num_rows != table.num_rows:
+                if scored.num_rows:
+                    pq.write_table(scored, part + '.tmp')
+                    os.replace(part + '.tmp', part)
+                else:
+                    os.remove(part)
+            done.update(scored.column('path').to_pylist())
+        return done
+
+    def __enter__(self):
+        os.makedirs(self.path, exist_ok=True)
+        numbers = [int(re.search(r'part-(\d+)', part).group(1)) for part in self._parts()]
+        self._next_part = max(numbers, default=-1) + 1
+        return self
+
+    def write(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.rows_per_file:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self._rows:
+            return
+        table = pa.Table.from_pylist(self._rows, schema=pa.schema(
+            [(c, pa.float32() if c.startswith('prob') else pa.string()) for c in COLUMNS]))
+        part = os.path.join(self.path, f'part-{self._next_part:05d}.parquet')
+        pq.write_table(table, part + '.tmp')
+        os.replace(part + '.tmp', part)
+        self._next_part += 1
+        self._rows = []
+
+    def __exit__(self, *exc):
+        # Also flush on Ctrl-C so finished batches are not rescored
+        self._flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help='image directory, file with one path per line, or -')
+    parser.add_argument('--output', required=True, help='.csv file or .parquet directory')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='decode/preprocess workers')
+    parser.add_argument('--prefetch', type=int, default=4,
+                        help='batches decoded ahead of the model')
+    parser.add_argument('--processes', action='store_true',
+                        help='decode in worker processes instead of threads')
+    parser.add_argument('--rows-per-file', type=int, default=ROWS_PER_PART,
+                        help='rows per Parquet part file')
+    args = parser.parse_args()
+
+    if args.output.endswith('.parquet'):
+        writer = ParquetWriter(args.output, args.rows_per_file)
+    else:
+        writer = CsvWriter(args.output)
+    done = writer.done_paths()
+    if done:
+        print(f"Resuming: {len(done)} images already scored", file=sys.stderr)
+
+    backend = get_backend()
+    backend.load()
+    todo = (path for path in iter_inputs(args.source) if path not in done)
+    scored = failed = 0
+    started = time.perf_counter()
+    with writer:
+        for paths, batch, failures in iter_preprocessed_batches(
+                todo, args.batch_size, args.workers, args.prefetch, args.processes):
+            probs = backend.predict(batch) if paths else None
+            writer.write(result_rows(paths, probs, failures))
+            scored += len(paths)
+            failed += len(failures)
+            elapsed = time.perf_counter() - started
+            print(f"\r{scored} scored, {failed} failed, {scored / elapsed:.1f} img/s",
+                  end='', file=sys.stderr)
+    print(file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""Evaluate the deployed model on a labeled image set before rollout.
+
+Usage:
+    python evaluate.py LABELED_DIR [--json report.json]
+    python evaluate.py labels.csv [--image-dir HAM10000_images/] [--json report.json]
+
+A labeled directory has one sub-directory per class. A CSV needs a path
+column (``path``, ``image`` or HAM10000's ``image_id``) and a label column
+(``label`` or HAM10000's ``dx``). Labels may be class names or HAM10000 codes
+(akiec, bcc, bkl, df, mel, nv, vasc). Reports top-1/2/3 accuracy (top-2 and
+top-3 through the registered ``top_2_accuracy``/``top_3_accuracy`` metrics),
+per-class precision/recall/F1, the confusion matrix and throughput.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from model_loader import top_2_accuracy, top_3_accuracy
+from inference import DEFAULT_BATCH_SIZE, classes, iter_image_paths, iter_preprocessed_batches
+from inference_backends import get_backend
+
+
+# HAM10000 diagnosis codes and other spellings used for the classes
+LABEL_ALIASES = {
+    'akiec': 'Actinic Keratosis', 'actinic keratoses': 'Actinic Keratosis',
+    'bcc': 'Basal Cell Carcinoma',
+    'bkl': 'Benign Keratosis', 'benign keratoses': 'Benign Keratosis',
+    'df': 'Dermatofibroma',
+    'mel': 'Melanoma',
+    'nv': 'Melanocytic Nevi',
+    'vasc': 'Vascular naevus', 'vascular naevi': 'Vascular naevus',
+    'vascular lesions': 'Vascular naevus',
+}
+CLASS_INDEX = {name.lower(): i for i, name in enumerate(classes)}
+
+
+# Function to map a label spelling to its index in classes
+def class_index(label):
+    label = label.strip().lower()
+    label = LABEL_ALIASES.get(label, label).lower()
+    if label not in CLASS_INDEX:
+        raise ValueError(f"Unknown label {label!r}")
+    return CLASS_INDEX[label]
+
+
+# Function to read (path, class index) pairs from a labeled directory or CSV
+def load_labels(source, image_dir=None):
+    samples = []
+    if os.path.isdir(source):
+        for entry in sorted(os.scandir(source), key=lambda e: e.name):
+            if entry.is_dir():
+                index = class_index(entry.name)
+                samples.extend((path, index) for path in iter_image_paths(entry.path))
+        return samples
+
+    with open(source, newline='') as f:
+        for row in csv.DictReader(f):
+            path = row.get('path') or row.get('image')
+            if path is None:
+                path = row['image_id'] + '.jpg'
+            label = row.get('label') or row['dx']
+            if image_dir:
+                path = os.path.join(image_dir, path)
+            samples.append((path, class_index(label)))
+    return samples
+
+
+# Function to compute accuracy, per-class scores and the confusion matrix
+def compute_metrics(y_true, probs):
+    n_classes = len(classes)
+    one_hot = np.eye(n_classes, dtype='float32')[y_true]
+    y_pred = probs.argmax(axis=1)
+
+    confusion = np.zeros((n_classes, n_classes), dtype=int)
+    np.add.at(confusion, (y_true, y_pred), 1)
+    tp = np.diag(confusion).astype(float)
+    predicted = confusion.sum(axis=0)
+    actual = confusion.sum(axis=1)
+    precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+    recall = np.divide(tp, actual, out=np.zeros_like(tp), where=actual > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall,
+                   out=np.zeros_like(tp), where=precision + recall > 0)
+
+    return {
+        'images': len(y_true),
+        'top1_accuracy': float(np.mean(y_pred == y_true)),
+        'top2_accuracy': float(np.mean(top_2_accuracy(one_hot, probs))),
+        'top3_accuracy': float(np.mean(top_3_accuracy(one_hot, probs))),
+        'per_class': {
+            name: {'precision': float(precision[i]), 'recall': float(recall[i]),
+                   'f1': float(f1[i]), 'support': int(actual[i])}
+            for i, name in enumerate(classes)
+        },
+        'confusion_matrix': confusion.tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help='labeled directory or CSV')
+    parser.add_argument('--image-dir', help='directory CSV paths are relative to')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='decode/preprocess workers')
+    parser.add_argument('--prefetch', type=int, default=4)
+    parser.add_argument('--processes', action='store_true',
+                        help='decode in worker processes instead of threads')
+    parser.add_argument('--json', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    samples = load_labels(args.source, args.image_dir)
+    labels = dict(samples)
+    backend = get_backend()
+    backend.load()
+
+    y_true, probs, failures = [], [], []
+    model_seconds = 0.0
+    started = time.perf_counter()
+    for paths, batch, failed in iter_preprocessed_batches(
+            (path for path, _ in samples), args.batch_size, args.workers,
+            args.prefetch, args.processes):
+        failures.extend(failed)
+        if paths:
+            model_started = time.perf_counter()
+            probs.append(backend.predict(batch))
+            model_seconds += time.perf_counter() - model_started
+            y_true.extend(labels[path] for path in paths)
+    elapsed = time.perf_counter() - started
+    if not y_true:
+        sys.exit("No images could be evaluated")
+
+    report = compute_metrics(np.array(y_true), np.concatenate(probs))
+    report['model'] = backend.version
+    report['failed'] = [{'path': p, 'error': e} for p, e in failures]
+    report['images_per_sec'] = len(y_true) / elapsed
+    report['model_images_per_sec'] = len(y_true) / model_seconds
+
+    print(f"Images: {report['images']} ({len(failures)} failed to load)")
+    print(f"Top-1 accuracy: {report['top1_accuracy']:.2%}")
+    print(f"Top-2 accuracy: {report['top2_accuracy']:.2%}")
+    print(f"Top-3 accuracy: {report['top3_accuracy']:.2%}")
+    print(f"{'':22s} {'precision':>9s} {'recall':>9s} {'f1':>9s} {'support':>8s}")
+    for name, m in report['per_class'].items():
+        print(f"{name:22s} {m['precision']:9.3f} {m['recall']:9.3f} {m['f1']:9.3f} "
+              f"{m['support']:8d}")
+    print("Confusion matrix (rows: true, columns: predicted):")
+    for name, row in zip(classes, report['confusion_matrix']):
+        print(f"  {name:22s} " + ' '.join(f'{v:6d}' for v in row))
+    print(f"Throughput: {report['images_per_sec']:.1f} img/s end to end, "
+          f"{report['model_images_per_sec']:.1f} img/s in the model")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
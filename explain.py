@@ -0,0 +1,190 @@
+"""Grad-CAM heatmaps showing which part of an image drove the prediction.
+
+Heatmaps come from the same forward pass as the class probabilities: one
+model call returns the last convolutional feature maps, the penultimate
+embedding and the probabilities, and one backward pass per explained class
+(top-1 or top-3) covers the whole batch. Heatmaps stay at the feature-map
+resolution (e.g. 7x7) in the cache and are only upsampled when overlaid on
+the display thumbnail.
+"""
+import os
+import threading
+import weakref
+
+import numpy as np
+from PIL import Image
+
+from inference import classes, preprocess_image, top_k_predictions
+from inference_backends import get_backend
+from model_loader import INPUT_SHAPE
+from prediction_cache import PredictionCache, cache_key
+from scheduler import get_scheduler, schedule_probabilities
+from telemetry import register_collector
+
+
+# Classes explained per image: 1 for the top class, 3 for the top-3
+EXPLAIN_TOP_K = int(os.environ.get('SKIN_EXPLAIN_TOP_K', 3))
+# Show heatmaps in the app unless turned off
+EXPLAIN_BY_DEFAULT = os.environ.get('SKIN_EXPLAIN', '1') == '1'
+HEATMAP_CACHE_PATH = os.environ.get('SKIN_HEATMAP_CACHE', 'heatmap_cache.sqlite3')
+
+
+# Function to find the last layer with a spatial (batch, height, width, channels) output
+def find_last_conv_layer(model):
+    for layer in reversed(model.layers):
+        if len(layer.output.shape) == 4:
+            return layer
+    raise ValueError("Model has no convolutional layer to explain")
+
+
+class GradCam:
+    """Computes probabilities, embeddings and Grad-CAM heatmaps for a batch."""
+
+    def __init__(self, model, layer_name=None):
+        import keras
+        import tensorflow as tf
+        layer = model.get_layer(layer_name) if layer_name else find_last_conv_layer(model)
+        if isinstance(model, keras.Sequential):
+            # A Sequential model's layer outputs are not connected to its output
+            # for gradients, so chain its layers again on a new input
+            inputs = keras.Input(model.input_shape[1:])
+            x = inputs
+            for each in model.layers:
+                x = each(x)
+                if each is layer:
+                    conv = x
+                if each is model.layers[-2]:
+                    embeddings = x
+            outputs = [conv, embeddings, x]
+        else:
+            inputs = model.inputs
+            outputs = [layer.output, model.layers[-2].output, model.outputs[0]]
+        self._model = keras.Model(inputs, outputs)
+        self.heatmap_shape = tuple(outputs[0].shape[1:3])
+        self.embedding_size = outputs[1].shape[-1]
+        self._compute = tf.function(self._compute_eager, reduce_retracing=True)
+
+    def _compute_eager(self, batch, k):
+        import tensorflow as tf
+        with tf.GradientTape(persistent=True) as tape:
+            conv, embeddings, probs = self._model(batch, training=False)
+            top = tf.math.top_k(probs, k).indices
+            scores = tf.gather(probs, top, batch_dims=1)
+            # Images are independent, so the gradient of the batch sum gives
+            # every image's gradient in one backward pass per class rank
+            totals = [tf.reduce_sum(scores[:, j]) for j in range(k)]
+        heatmaps = []
+        for total in totals:
+            grads = tape.gradient(total, conv)
+            weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+            cam = tf.nn.relu(tf.reduce_sum(weights * conv, axis=-1))
+            heatmaps.append(cam / (tf.reduce_max(cam, axis=(1, 2), keepdims=True) + 1e-8))
+        del tape
+        return probs, embeddings, tf.stack(heatmaps, axis=1)
+
+    def __call__(self, batch, k=EXPLAIN_TOP_K):
+        """Return ``(probs, embeddings, heatmaps)``; heatmaps are (batch, k, h, w) in [0, 1]."""
+        probs, embeddings, heatmaps = self._compute(
+            np.asarray(batch, dtype=np.float32), min(k, len(classes)))
+        return probs.numpy(), embeddings.numpy(), heatmaps.numpy()
+
+
+_grad_cams = weakref.WeakKeyDictionary()
+_grad_cams_lock = threading.Lock()
+
+
+# Function to get the Grad-CAM view of a model, built once per model
+def get_grad_cam(model):
+    with _grad_cams_lock:
+        if model not in _grad_cams:
+            _grad_cams[model] = GradCam(model)
+        return _grad_cams[model]
+
+
+# Function to trace the Grad-CAM graph for one image and for batches before the first request
+def warm_up_grad_cam(model, k=EXPLAIN_TOP_K):
+    grad_cam = get_grad_cam(model)
+    # The second batch size makes reduce_retracing build the any-batch-size graph
+    for batch_size in (1, 2):
+        grad_cam(np.zeros((batch_size,) + INPUT_SHAPE, dtype=np.float32), k)
+
+
+# Function to map values in [0, 1] to RGB with a blue-green-yellow-red ramp
+def colorize(heatmap):
+    stops = np.array([[0, 0, 128], [0, 128, 255], [0, 255, 128],
+                      [255, 255, 0], [255, 0, 0]], dtype=np.float32)
+    position = np.clip(heatmap, 0, 1) * (len(stops) - 1)
+    low = np.floor(position).astype(int).clip(0, len(stops) - 2)
+    frac = (position - low)[..., None]
+    return (stops[low] * (1 - frac) + stops[low + 1] * frac).astype(np.uint8)
+
+
+# Function to blend a heatmap over the display thumbnail at the thumbnail's resolution
+def overlay_heatmap(thumbnail, heatmap, alpha=0.4):
+    heatmap = Image.fromarray(np.asarray(heatmap, dtype=np.float32), mode='F')
+    heatmap = np.asarray(heatmap.resize(thumbnail.size, Image.BILINEAR))
+    colored = Image.fromarray(colorize(heatmap))
+    return Image.blend(thumbnail.convert('RGB'), colored, alpha)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Function to get the process-wide heatmap cache
+def get_heatmap_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PredictionCache(HEATMAP_CACHE_PATH)
+            register_collector(_cache_gauges)
+        return _cache
+
+
+def _cache_gauges():
+    stats = _cache.stats()
+    return {'skin_heatmap_cache_hit_rate': ('Fraction of heatmap lookups served from the cache',
+                                            stats['hit_rate'])}
+
+
+# Function to predict and explain uploads, reusing cached heatmaps for images seen before
+def cached_explanations(images_bytes, model_inputs, k=3, explain_k=EXPLAIN_TOP_K, cache=None):
+    """Return ``(results, embeddings, heatmaps)`` for the uploads.
+
+    Each cached row holds the class probabilities, the embedding and the
+    flattened heatmaps, keyed by image hash, model version and ``explain_k``.
+    """
+    cache = cache or get_heatmap_cache()
+    backend = get_backend()
+    version = f'{backend.version}:gradcam{explain_k}'
+    keys = [cache_key(data, version) for data in images_bytes]
+    rows = [cache.get(key) for key in keys]
+
+    missing = [i for i, r in enumerate(rows) if r is None]
+    if missing:
+        computed = schedule_probabilities(
+            [model_inputs[i] for i in missing], get_scheduler('explanations'))
+        for i, row in zip(missing, computed):
+            cache.put(keys[i], row)
+            rows[i] = row
+
+    grad_cam = get_grad_cam(backend.model)
+    rows = np.stack(rows)
+    n_classes, embedding_end = len(classes), len(classes) + grad_cam.embedding_size
+    heatmaps = rows[:, embedding_end:].reshape(
+        (len(rows), -1) + grad_cam.heatmap_shape)
+    return top_k_predictions(rows[:, :n_classes], k), rows[:, n_classes:embedding_end], heatmaps
+
+
+# Function to predict and explain a list of images with the given Keras model
+def explain_images(paths_or_arrays, model, batch_size=32, k=3, explain_k=EXPLAIN_TOP_K):
+    """Return ``[(top_classes, top_probs, top_class, top_prob, heatmaps)]``."""
+    grad_cam = get_grad_cam(model)
+    items = list(paths_or_arrays)
+    results = []
+    for start in range(0, len(items), batch_size):
+        batch = np.stack([preprocess_image(item) for item in items[start:start + batch_size]])
+        probs, _, heatmaps = grad_cam(batch, explain_k)
+        results.extend(result + (maps,) for result, maps in
+                       zip(top_k_predictions(probs, k), heatmaps))
+    return results
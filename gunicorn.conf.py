@@ -0,0 +1,27 @@
+# Gunicorn settings for the headless inference service:
+#     gunicorn -c gunicorn.conf.py server:app
+import multiprocessing
+import os
+
+
+bind = os.environ.get('SKIN_SERVER_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('SKIN_SERVER_WORKERS', multiprocessing.cpu_count()))
+# Threads per worker; concurrent requests in a worker are merged into one
+# batch by the micro-batching scheduler
+worker_class = 'gthread'
+threads = int(os.environ.get('SKIN_SERVER_THREADS', 8))
+timeout = 120
+
+# Import server.py once in the master so workers share its pages copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    from server import preload
+    preload()
+
+
+def post_fork(server, worker):
+    # Load (or, for TFLite, just warm) the model in each worker before it serves
+    from inference_backends import get_backend
+    get_backend().load()
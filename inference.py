@@ -0,0 +1,133 @@
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from ingest import load_model_input
+from model_loader import INPUT_SHAPE
+
+
+# Prediction classes
+classes = [
+    'Actinic Keratosis', 'Basal Cell Carcinoma', 'Benign Keratosis',
+    'Dermatofibroma', 'Melanoma', 'Melanocytic Nevi', 'Vascular naevus',
+]
+
+DEFAULT_BATCH_SIZE = 32
+
+# File types accepted by the uploader and the offline tools
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.jfif')
+
+
+# Function to lazily walk a directory tree for image files, in a stable order
+def iter_image_paths(root):
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        if entry.is_dir():
+            yield from iter_image_paths(entry.path)
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            yield entry.path
+
+
+# Function to turn an image path or array into a normalised 224x224x3 tensor
+def preprocess_image(image):
+    # Float arrays are taken as already normalised, anything else as 0-255 pixels
+    if isinstance(image, np.ndarray) and np.issubdtype(image.dtype, np.floating):
+        return image.reshape(INPUT_SHAPE).astype('float32', copy=False)
+    # Paths are decoded like uploads, so offline tools score what the app serves
+    img = image if isinstance(image, np.ndarray) else load_model_input(image)
+    return img.reshape(INPUT_SHAPE).astype('float32') / 255.0
+
+
+# Function to compute the top-k classes for every row of a probability matrix
+def top_k_predictions(probs, k=3):
+    """Return ``(top_classes, top_probs, top_class, top_prob)`` per row.
+
+    Ties keep both classes, unlike a dict keyed by probability.
+    """
+    probs = np.asarray(probs)
+    k = min(k, probs.shape[1])
+    # argpartition finds the k largest in O(n); only those k are then sorted
+    top_idx = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+    top_vals = np.take_along_axis(probs, top_idx, axis=1)
+    order = np.argsort(-top_vals, axis=1, kind='stable')
+    top_idx = np.take_along_axis(top_idx, order, axis=1)
+    top_vals = np.take_along_axis(top_vals, order, axis=1)
+    top_pcts = (top_vals * 100).round(2)
+
+    results = []
+    for idx_row, val_row, pct_row in zip(top_idx, top_vals, top_pcts):
+        top_classes = [classes[i] for i in idx_row]
+        results.append((top_classes, list(pct_row), top_classes[0], val_row[0]))
+    return results
+
+
+# Function to predict many images with one forward pass per batch
+def predict_images(paths_or_arrays, model, batch_size=DEFAULT_BATCH_SIZE, k=3, explain=False):
+    """With ``explain=True`` each result also ends with its Grad-CAM heatmaps."""
+    if explain:
+        from explain import explain_images
+        return explain_images(paths_or_arrays, model, batch_size, k)
+    items = list(paths_or_arrays)
+    results = []
+    for start in range(0, len(items), batch_size):
+        batch = np.stack([preprocess_image(item)
+                          for item in items[start:start + batch_size]])
+        probs = model.predict(batch, batch_size=len(batch), verbose=0)
+        results.extend(top_k_predictions(probs, k))
+    return results
+
+
+def predict_image(image_path, model, threshold=0.5, explain=False):
+    result = predict_images([image_path], model, batch_size=1, explain=explain)[0]
+    if explain:
+        return result
+    top_classes, top_probs, top_class, top_prob = result
+    return top_classes, top_probs, top_class, top_prob
+
+
+# Function to preprocess one image, returning the error instead of raising
+def _preprocess_or_error(path):
+    try:
+        return preprocess_image(path), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+# Function to decode and preprocess images on a pool, a few batches ahead of the model
+def iter_preprocessed_batches(paths, batch_size=DEFAULT_BATCH_SIZE, workers=None,
+                              prefetch=4, processes=False):
+    """Yield ``(paths, batch, failures)`` for consecutive chunks of ``paths``.
+
+    ``paths`` is consumed lazily: at most ``prefetch`` batches are decoding
+    at any time. ``batch`` stacks the images that decoded, in the order of
+    the returned ``paths``; ``failures`` lists ``(path, error)`` for the rest.
+    Decoding uses ``preprocess_image``, the same as ``predict_image``.
+    """
+    paths = iter(paths)
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers=workers) as pool:
+        pending = deque()
+
+        def submit_next():
+            chunk = list(itertools.islice(paths, batch_size))
+            if chunk:
+                pending.append((chunk, pool.map(_preprocess_or_error, chunk)))
+
+        for _ in range(prefetch):
+            submit_next()
+        while pending:
+            chunk, results = pending.popleft()
+            submit_next()
+            ok_paths, arrays, failures = [], [], []
+            for path, (array, error) in zip(chunk, results):
+                if error is None:
+                    ok_paths.append(path)
+                    arrays.append(array)
+                else:
+                    failures.append((path, error))
+            batch = np.stack(arrays) if arrays else np.empty((0,) + INPUT_SHAPE, dtype='float32')
+            yield ok_paths, batch, failures
@@ -0,0 +1,235 @@
+"""Inference backends behind predict_image and the scheduler.
+
+Every backend has ``predict(batch)`` with the same contract as
+``model.predict``, so it can be passed anywhere a Keras model is expected,
+``load()`` to load and warm it up ahead of the first request, and a
+``version`` string used to key cached predictions. Backends that support
+similar-case retrieval and Grad-CAM also have ``predict_with_embeddings(batch)``
+and ``predict_with_explanations(batch)``.
+
+Convert the Keras model to TFLite with:
+    python inference_backends.py --quantization int8 --calibration-dir samples/ --output model_int8.tflite
+"""
+import argparse
+import itertools
+import os
+import threading
+
+import numpy as np
+
+from model_loader import INPUT_SHAPE, MODEL_JSON_PATH, MODEL_WEIGHTS_PATH, \
+    file_sha256, get_model, get_model_version, load_model, warm_up
+from inference import iter_image_paths, preprocess_image
+from thread_tuning import get_thread_config, inference_slot
+
+
+# Which backend get_backend() returns: 'keras' or 'tflite'
+INFERENCE_BACKEND = os.environ.get('SKIN_INFERENCE_BACKEND', 'keras')
+# Path of the converted model used by the 'tflite' backend
+TFLITE_MODEL_PATH = os.environ.get('SKIN_TFLITE_MODEL', 'model.tflite')
+
+QUANTIZATION_MODES = ['none', 'fp16', 'int8-dynamic', 'int8']
+
+
+class KerasBackend:
+    """Full-precision Keras graph from model.json + model.h5.
+
+    Without an explicit ``model`` it uses the shared, hot-reloaded model from
+    ``model_loader``.
+    """
+
+    name = 'keras'
+
+    def __init__(self, model=None):
+        self._model = model
+        self._warmed_up = False
+        self._embedding_model = None
+        self._embedding_source = None
+
+    @property
+    def model(self):
+        return self._model if self._model is not None else get_model()
+
+    @property
+    def version(self):
+        return 'keras:' + get_model_version() if self._model is None else 'keras:custom'
+
+    def load(self):
+        # The shared model is warmed up by model_loader each time it is (re)loaded
+        if self._model is not None and not self._warmed_up:
+            warm_up(self._model)
+            self._warmed_up = True
+        return self.model
+
+    # predict_on_batch skips the per-call setup of model.predict, about 100 ms on Keras 3
+    def predict(self, batch, batch_size=None, verbose=0):
+        model = self.model
+        batch_size = batch_size or len(batch)
+        with inference_slot():
+            return np.concatenate([model.predict_on_batch(batch[start:start + batch_size])
+                                   for start in range(0, len(batch), batch_size)])
+
+    # Function to get the class probabilities and penultimate-layer
+    # embeddings from one forward pass
+    def predict_with_embeddings(self, batch):
+        model = self.model
+        # Rebuild the two-output view when the shared model is hot-reloaded
+        if self._embedding_source is not model:
+            import keras
+            self._embedding_model = keras.Model(
+                model.inputs, [model.outputs[0], model.layers[-2].output])
+            self._embedding_source = model
+        with inference_slot():
+            probs, embeddings = self._embedding_model.predict_on_batch(batch)
+        return np.asarray(probs), np.asarray(embeddings)
+
+    # Function to get probabilities, embeddings and Grad-CAM heatmaps from one forward pass
+    def predict_with_explanations(self, batch, k=None):
+        from explain import EXPLAIN_TOP_K, get_grad_cam
+        with inference_slot():
+            return get_grad_cam(self.model)(batch, k or EXPLAIN_TOP_K)
+
+
+class TFLiteBackend:
+    """Converted TFLite model, run with the TFLite interpreter.
+
+    int8 models with quantized input/output tensors are handled by scaling
+    with the tensors' quantization parameters. The interpreter is not thread
+    safe, so calls are serialised.
+    """
+
+    name = 'tflite'
+
+    def __init__(self, model_path=TFLITE_MODEL_PATH, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.model_path = model_path
+        self.version = 'tflite:' + file_sha256(model_path)
+        self._interpreter = Interpreter(
+            model_path=model_path,
+            num_threads=num_threads or get_thread_config()['intra_op'] or None)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        if batch_size != self._batch_size:
+            self._interpreter.resize_tensor_input(
+                self._input['index'], (batch_size,) + INPUT_SHAPE)
+            self._interpreter.allocate_tensors()
+            self._batch_size = batch_size
+
+    def load(self):
+        self.predict(np.zeros((1,) + INPUT_SHAPE, dtype=np.float32))
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            self._resize(len(batch))
+            scale, zero_point = self._input['quantization']
+            if self._input['dtype'] != np.float32:
+                batch = np.round(batch / scale + zero_point).astype(self._input['dtype'])
+            self._interpreter.set_tensor(self._input['index'], batch)
+            self._interpreter.invoke()
+            out = self._interpreter.get_tensor(self._output['index'])
+        scale, zero_point = self._output['quantization']
+        if self._output['dtype'] != np.float32:
+            out = (out.astype(np.float32) - zero_point) * scale
+        return out
+
+    def predict_with_embeddings(self, batch):
+        raise NotImplementedError(
+            "The TFLite backend only outputs class probabilities; "
+            "use the Keras backend for similar-case retrieval")
+
+    def predict_with_explanations(self, batch, k=None):
+        raise NotImplementedError(
+            "Grad-CAM needs gradients; use the Keras backend for heatmaps")
+
+
+# Function to convert a Keras model to TFLite with optional quantization
+def convert_to_tflite(model, output_path, quantization='none', calibration_images=None,
+                      calibration_steps=100):
+    """Write ``model`` as a TFLite flatbuffer.
+
+    ``fp16`` stores weights as float16, ``int8-dynamic`` stores weights as
+    int8 and quantizes activations at run time, and ``int8`` fully quantizes
+    using ``calibration_images`` (paths or arrays) to calibrate activations.
+    """
+    import tensorflow as tf
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATION_MODES}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        images = list(itertools.islice(calibration_images or [], calibration_steps))
+        if not images:
+            raise ValueError("int8 quantization needs calibration images")
+
+        def representative_dataset():
+            for image in images:
+                yield [preprocess_image(image)[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+# Function to get the configured process-wide inference backend
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            # Thread pools must be configured before TensorFlow starts
+            get_thread_config()
+            if INFERENCE_BACKEND == 'tflite':
+                _backend = TFLiteBackend()
+            else:
+                _backend = KerasBackend()
+        return _backend
+
+
+# Function to replace the process-wide backend, e.g. with a stand-in model for load tests
+def set_backend(backend):
+    global _backend
+    get_thread_config()
+    with _backend_lock:
+        _backend = backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the Keras model to TFLite.')
+    parser.add_argument('--quantization', choices=QUANTIZATION_MODES, default='none')
+    parser.add_argument('--calibration-dir',
+                        help='directory of sample images for int8 calibration')
+    parser.add_argument('--calibration-steps', type=int, default=100)
+    parser.add_argument('--model-json', default=MODEL_JSON_PATH)
+    parser.add_argument('--model-weights', default=MODEL_WEIGHTS_PATH)
+    parser.add_argument('--output', default=TFLITE_MODEL_PATH)
+    args = parser.parse_args()
+
+    model = load_model(args.model_json, args.model_weights)
+    calibration = iter_image_paths(args.calibration_dir) if args.calibration_dir else None
+    convert_to_tflite(model, args.output, args.quantization, calibration,
+                      args.calibration_steps)
+    print(f"Wrote {args.quantization} model to {args.output} "
+          f"({os.path.getsize(args.output) / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+from model_loader import IMAGE_SIZE
+
+
+# Largest image we are willing to decode (width * height)
+MAX_IMAGE_PIXELS = int(os.environ.get('SKIN_MAX_IMAGE_PIXELS', 40_000_000))
+# Bounding box of the thumbnail shown next to the prediction
+THUMBNAIL_SIZE = (512, 512)
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+class ImageTooLargeError(InvalidImageError):
+    pass
+
+
+# Function to turn a decoded image into the 224x224 uint8 model input
+def to_model_input(img):
+    """Resize the full-resolution image with nearest-neighbour, as ``load_img`` does.
+
+    Every path to the model (the app, the HTTP service, ``predict_image`` and
+    the offline tools) builds its input here, so they all score the same tensor.
+    """
+    return np.asarray(img.convert('RGB').resize(IMAGE_SIZE, Image.NEAREST), dtype=np.uint8)
+
+
+# Function to read an image file or file-like object into the model input
+def load_model_input(path):
+    with Image.open(path) as img:
+        return to_model_input(img)
+
+
+# Function to decode an uploaded image once for both display and inference
+def decode_upload(data, thumbnail_size=THUMBNAIL_SIZE, max_pixels=MAX_IMAGE_PIXELS,
+                  thumbnail=True):
+    """Decode image bytes into ``(thumbnail, model_input)``.
+
+    Only the header is read before the pixel-count check, so oversized images
+    are rejected without being decoded. ``model_input`` comes from the
+    full-resolution decode through ``to_model_input``; the thumbnail is then
+    shrunk from the same decode. Unreadable, truncated and oversized images
+    raise ``InvalidImageError``. With ``thumbnail=False`` no thumbnail is
+    made and ``None`` is returned in its place.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+    except OSError as e:
+        # UnidentifiedImageError is an OSError too
+        raise InvalidImageError(f"Not a readable image: {e}") from e
+    if img.width * img.height > max_pixels:
+        raise ImageTooLargeError(
+            f"Image is {img.width}x{img.height}, larger than the "
+            f"{max_pixels} pixel limit.")
+
+    try:
+        # A truncated upload only fails here, once the pixels are decoded
+        img = img.convert('RGB')
+    except OSError as e:
+        raise InvalidImageError(f"Image could not be decoded: {e}") from e
+    model_input = to_model_input(img)
+    if not thumbnail:
+        return None, model_input
+    img.thumbnail(thumbnail_size)
+    return img, model_input
@@ -0,0 +1,318 @@
+"""Simulate concurrent clinic sessions to find how many users one instance serves.
+
+Usage:
+    python load_test.py [--users 1,8,32] [--duration 60] [--output load.json]
+    python load_test.py --url http://127.0.0.1:8000 --server-pid PID [--users 16]
+
+Each simulated user loops through log in -> upload -> predict -> Know About
+Diseases with a random think time between flows, uploading synthetic JPEGs
+at dermoscopy (600x450) and phone-camera (4032x3024) sizes. Each upload
+gets a unique trailer after the JPEG end marker, so no two uploads share a
+prediction-cache entry.
+
+By default the users run in this process against the same code the
+Streamlit page calls: the SQLite user store, ``decode_upload`` and the
+background prediction jobs behind the micro-batching scheduler. Streamlit's
+own rendering is not included. With ``--url`` they drive a running
+``server.py`` over HTTP instead (``/``, ``/api/predict`` and ``/about``).
+A stand-in model with random weights is used when ``model.h5`` is missing.
+
+For each user count it reports flows/s, per-stage latency percentiles, the
+error rate and process RSS sampled over time. ``--max-p95-ms`` makes the
+run fail when the predict p95 exceeds a limit, to catch regressions.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+
+import numpy as np
+
+from benchmark import DEFAULT_IMAGE_SIZES, make_images
+
+
+STAGES = ['login', 'upload', 'predict', 'know_about', 'flow']
+
+
+# Function to read the resident set size of a process in MB
+def rss_mb(pid=None):
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    if pid is None:
+        import resource
+        # Peak rather than current RSS where /proc is not available
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+    return None
+
+
+class LocalClient:
+    """Runs each step through the modules app.py uses, in this process."""
+
+    def __init__(self, store, stand_in, explain=False):
+        from inference_backends import KerasBackend, get_backend, set_backend
+        from model_loader import MODEL_WEIGHTS_PATH, build_stand_in_model
+        from prediction_jobs import get_job_manager
+
+        if stand_in or not os.path.exists(MODEL_WEIGHTS_PATH):
+            set_backend(KerasBackend(build_stand_in_model()))
+            self.model_source = 'stand-in'
+        else:
+            self.model_source = 'model.h5'
+        get_backend().load()
+        self.store = store
+        self.explain = explain
+        self.jobs = get_job_manager()
+
+    def login(self, email, password):
+        user = self.store.get_user(email)
+        if user is None or user['password'] != password:
+            raise RuntimeError("Login rejected")
+
+    def upload_and_predict(self, session_id, image_bytes, timings):
+        from ingest import decode_upload
+        started = time.perf_counter()
+        _, model_input = decode_upload(image_bytes)
+        timings['upload'] = time.perf_counter() - started
+        started = time.perf_counter()
+        job = self.jobs.submit(session_id, image_bytes, model_input, self.explain)
+        job.result()
+        timings['predict'] = time.perf_counter() - started
+        self.jobs.collect(*job.key)
+
+    def know_about(self):
+        # The page is static text; only the user's reading time is simulated
+        pass
+
+
+class HttpClient:
+    """Drives a running server.py over HTTP."""
+
+    def __init__(self, url, timeout=120):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.model_source = url
+
+    def _request(self, path, data=None, headers=None):
+        request = urllib.request.Request(self.url + path, data=data, headers=headers or {})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+    def login(self, email, password):
+        self._request('/')
+
+    def upload_and_predict(self, session_id, image_bytes, timings):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+                f'filename="upload.jpg"\r\nContent-Type: image/jpeg\r\n\r\n').encode() \
+            + image_bytes + f'\r\n--{boundary}--\r\n'.encode()
+        started = time.perf_counter()
+        self._request('/api/predict', body,
+                      {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        # The server decodes and predicts in one request, timed as predict
+        timings['predict'] = time.perf_counter() - started
+
+    def know_about(self):
+        self._request('/about')
+
+
+class LoadRun:
+    def __init__(self, client, images, users, duration, think_seconds, sample_interval,
+                 server_pid=None):
+        self.client = client
+        self.images = images
+        self.users = users
+        self.duration = duration
+        self.think_seconds = think_seconds
+        self.sample_interval = sample_interval
+        self.server_pid = server_pid
+        self._lock = threading.Lock()
+        self.latencies = {stage: [] for stage in STAGES}
+        self.errors = {}
+        self.flows = 0
+        self.timeline = []
+
+    def _user(self, index, deadline):
+        rng = random.Random(index)
+        session_id = f'load-test-{index}'
+        email, password = f'user{index}@example.com', 'Passw0rd!'
+        while time.perf_counter() < deadline:
+            timings = {}
+            flow_started = time.perf_counter()
+            stage = 'login'
+            try:
+                started = time.perf_counter()
+                self.client.login(email, password)
+                timings['login'] = time.perf_counter() - started
+
+                stage = 'predict'
+                image_bytes = rng.choice(self.images) + uuid.uuid4().bytes
+                self.client.upload_and_predict(session_id, image_bytes, timings)
+
+                stage = 'know_about'
+                started = time.perf_counter()
+                self.client.know_about()
+                timings['know_about'] = time.perf_counter() - started
+                timings['flow'] = time.perf_counter() - flow_started
+            except Exception as e:
+                with self._lock:
+                    key = f'{stage}: {type(e).__name__}'
+                    self.errors[key] = self.errors.get(key, 0) + 1
+            else:
+                with self._lock:
+                    self.flows += 1
+                    for name, seconds in timings.items():
+                        self.latencies[name].append(seconds)
+            time.sleep(rng.expovariate(1.0 / self.think_seconds) if self.think_seconds else 0)
+
+    def _sample(self, started, stop):
+        while not stop.wait(self.sample_interval):
+            with self._lock:
+                flows, errors = self.flows, sum(self.errors.values())
+            self.timeline.append({
+                'seconds': round(time.perf_counter() - started, 1),
+                'flows': flows,
+                'errors': errors,
+                'rss_mb': rss_mb(self.server_pid),
+            })
+
+    def run(self):
+        started = time.perf_counter()
+        deadline = started + self.duration
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(started, stop), daemon=True)
+        sampler.start()
+        threads = [threading.Thread(target=self._user, args=(i, deadline), daemon=True)
+                   for i in range(self.users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        sampler.join()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        errors = sum(self.errors.values())
+        stages = {}
+        for stage, seconds in self.latencies.items():
+            if seconds:
+                ms = np.array(seconds) * 1000.0
+                stages[stage] = {'count': len(ms),
+                                 'p50_ms': float(np.percentile(ms, 50)),
+                                 'p95_ms': float(np.percentile(ms, 95)),
+                                 'p99_ms': float(np.percentile(ms, 99))}
+        rss = [s['rss_mb'] for s in self.timeline if s['rss_mb'] is not None]
+        return {
+            'users': self.users,
+            'seconds': elapsed,
+            'flows': self.flows,
+            'flows_per_sec': self.flows / elapsed,
+            'errors': self.errors,
+            'error_rate': errors / (self.flows + errors) if self.flows + errors else 0.0,
+            'stages': stages,
+            'peak_rss_mb': max(rss) if rss else None,
+            'timeline': self.timeline,
+        }
+
+
+# Function to create a throwaway user store with one account per simulated user
+def make_user_store(directory, users):
+    from user_store import SQLiteUserStore
+    store = SQLiteUserStore(os.path.join(directory, 'load_test_users.db'))
+    for i in range(users):
+        store.add_user(f'user{i}@example.com', f'User {i}', 'Passw0rd!')
+    return store
+
+
+def print_report(report):
+    print(f"{report['users']} users: {report['flows_per_sec']:.2f} flows/s, "
+          f"{report['flows']} flows, error rate {report['error_rate']:.1%}"
+          + (f", peak RSS {report['peak_rss_mb']:.0f} MB" if report['peak_rss_mb'] else ''))
+    for stage, r in report['stages'].items():
+        print(f"  {stage:11s} p50 {r['p50_ms']:9.1f}  p95 {r['p95_ms']:9.1f}  "
+              f"p99 {r['p99_ms']:9.1f} ms")
+    for error, count in report['errors'].items():
+        print(f"  error {error}: {count}")
+    previous = 0
+    for sample in report['timeline']:
+        rss = f"{sample['rss_mb']:8.0f} MB" if sample['rss_mb'] is not None else ''
+        print(f"  t={sample['seconds']:6.1f}s  {sample['flows'] - previous:5d} flows  "
+              f"{sample['errors']:4d} errors  {rss}")
+        previous = sample['flows']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', default='1,4,16',
+                        help='comma-separated concurrent user counts, run one after another')
+    parser.add_argument('--duration', type=float, default=60, help='seconds per user count')
+    parser.add_argument('--think-seconds', type=float, default=1.0,
+                        help='mean pause between a user\'s flows')
+    parser.add_argument('--image-sizes', default=','.join(DEFAULT_IMAGE_SIZES),
+                        help='comma-separated WIDTHxHEIGHT of synthetic uploads')
+    parser.add_argument('--sample-interval', type=float, default=5.0,
+                        help='seconds between throughput/RSS samples')
+    parser.add_argument('--url', help='drive a running server.py instead of this process')
+    parser.add_argument('--server-pid', type=int, help='process whose RSS to sample with --url')
+    parser.add_argument('--stand-in', action='store_true',
+                        help='use the stand-in model even if model.h5 exists')
+    parser.add_argument('--explain', action='store_true',
+                        help='also compute Grad-CAM heatmaps, as the app does by default')
+    parser.add_argument('--max-p95-ms', type=float,
+                        help='exit with an error if predict p95 exceeds this at any user count')
+    parser.add_argument('--output', help='write the reports to this JSON file')
+    args = parser.parse_args()
+
+    user_counts = [int(n) for n in args.users.split(',')]
+    with tempfile.TemporaryDirectory() as tmp:
+        images = []
+        for path in make_images(tmp, args.image_sizes.split(',')):
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        if args.url:
+            client = HttpClient(args.url)
+        else:
+            # Keep the load test's predictions out of the app's cache
+            os.environ.setdefault('SKIN_PREDICTION_CACHE',
+                                  os.path.join(tmp, 'prediction_cache.sqlite3'))
+            os.environ.setdefault('SKIN_HEATMAP_CACHE', os.path.join(tmp, 'heatmap_cache.sqlite3'))
+            client = LocalClient(make_user_store(tmp, max(user_counts)), args.stand_in,
+                                 args.explain)
+
+        reports = []
+        for users in user_counts:
+            run = LoadRun(client, images, users, args.duration, args.think_seconds,
+                          args.sample_interval, args.server_pid)
+            report = run.run()
+            reports.append(report)
+            print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'model': client.model_source, 'cpu_count': os.cpu_count(),
+                       'reports': reports}, f, indent=2)
+
+    if args.max_p95_ms:
+        slow = [r['users'] for r in reports
+                if r['stages'].get('predict', {}).get('p95_ms', 0) > args.max_p95_ms]
+        if slow:
+            print(f"Predict p95 above {args.max_p95_ms} ms at {slow} users", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
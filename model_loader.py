@@ -0,0 +1,224 @@
+import hashlib
+import os
+import sys
+import threading
+
+import numpy as np
+
+from telemetry import span
+
+# keras and tensorflow are imported inside the functions that need them, so
+# importing this module (and the pages that never predict) stays cheap.
+
+
+def top_2_accuracy(y_true, y_pred):
+    from keras import metrics
+    return metrics.top_k_categorical_accuracy(y_true, y_pred, k=2)
+
+
+def top_3_accuracy(y_true, y_pred):
+    from keras import metrics
+    return metrics.top_k_categorical_accuracy(y_true, y_pred, k=3)
+
+
+_metrics_registered = False
+
+
+# Register the custom metric functions as serializable
+def register_custom_metrics():
+    global _metrics_registered
+    if not _metrics_registered:
+        import keras
+        keras.saving.register_keras_serializable()(top_2_accuracy)
+        keras.saving.register_keras_serializable()(top_3_accuracy)
+        _metrics_registered = True
+
+
+# Paths for model files
+MODEL_JSON_PATH = os.environ.get(
+    'SKIN_MODEL_JSON', r'F:\Skin-LesionDetection-main\Skin\Skin\model.json')
+MODEL_WEIGHTS_PATH = os.environ.get(
+    'SKIN_MODEL_WEIGHTS', r'F:\Skin-LesionDetection-main\Skin\Skin\model.h5')
+
+# Load the model in the background at boot instead of on first use
+PREWARM = os.environ.get('SKIN_PREWARM', '0') == '1'
+
+# Input shape expected by the network
+IMAGE_SIZE = (224, 224)
+INPUT_SHAPE = IMAGE_SIZE + (3,)
+
+
+# Function to hash a file in chunks without reading it into memory at once
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to combine the hashes of the model files into one version string
+def model_files_version(json_path=MODEL_JSON_PATH, weights_path=MODEL_WEIGHTS_PATH):
+    digest = hashlib.sha256()
+    digest.update(file_sha256(json_path).encode())
+    digest.update(file_sha256(weights_path).encode())
+    return digest.hexdigest()
+
+
+# Function to build the model from the JSON architecture, without weights
+def build_model(json_path=MODEL_JSON_PATH):
+    from tensorflow.keras.models import model_from_json
+    register_custom_metrics()
+    with open(json_path, 'r') as j_file:
+        loaded_json_model = j_file.read()
+    return model_from_json(loaded_json_model, custom_objects={
+                           'top_2_accuracy': top_2_accuracy, 'top_3_accuracy': top_3_accuracy})
+
+
+# Function to build the model from the JSON architecture and .h5 weights
+def load_model(json_path=MODEL_JSON_PATH, weights_path=MODEL_WEIGHTS_PATH):
+    model = build_model(json_path)
+    model.load_weights(weights_path)
+    return model
+
+
+# Function to build a model with the real input/output shape but random weights
+def build_stand_in_model(json_path=MODEL_JSON_PATH, num_classes=7):
+    """Stand-in for benchmarks and load tests when model.h5 is not available.
+
+    Uses the real architecture from ``json_path`` when that file exists, and a
+    small CNN with the same 224x224x3 -> ``num_classes`` shape otherwise.
+    """
+    import keras
+    from keras import layers
+    if os.path.exists(json_path):
+        return build_model(json_path)
+    return keras.Sequential([
+        keras.Input(INPUT_SHAPE),
+        layers.Conv2D(32, 3, activation='relu'),
+        layers.MaxPooling2D(),
+        layers.Conv2D(64, 3, activation='relu'),
+        layers.MaxPooling2D(),
+        layers.Conv2D(128, 3, activation='relu'),
+        layers.MaxPooling2D(),
+        layers.Conv2D(128, 3, activation='relu', name='last_conv'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(128, activation='relu'),
+        layers.Dense(num_classes, activation='softmax'),
+    ])
+
+
+# Function to run a dummy forward pass so the first real prediction is not slow
+def warm_up(model):
+    model.predict_on_batch(np.zeros((1,) + INPUT_SHAPE, dtype='float32'))
+    from explain import EXPLAIN_BY_DEFAULT, warm_up_grad_cam
+    # Explained predictions run a separate traced graph; trace it now as well
+    if EXPLAIN_BY_DEFAULT:
+        warm_up_grad_cam(model)
+
+
+class ModelVersionError(RuntimeError):
+    pass
+
+
+class ModelHolder:
+    """Process-wide model cache that reloads only when the model files change.
+
+    Streamlit re-executes ``app.py`` on every interaction, but imported modules
+    stay in ``sys.modules``, so a holder living here is shared by every session
+    in the process. Each ``get()`` only stats the model files; the files are
+    hashed when their mtime changes and the model is rebuilt only if the
+    combined hash differs from the one currently loaded.
+
+    With a ``pinned_version`` (set by the gunicorn master, see
+    ``pin_model_version``) only that version is ever loaded, so every worker
+    serves the same model: changed files are reported and ignored, and a
+    worker whose files no longer match refuses to start.
+    """
+
+    def __init__(self, json_path=MODEL_JSON_PATH, weights_path=MODEL_WEIGHTS_PATH):
+        self.json_path = json_path
+        self.weights_path = weights_path
+        self.pinned_version = None
+        self._lock = threading.Lock()
+        self._model = None
+        self._mtimes = None
+        self.version = None
+        self.load_count = 0
+
+    def _stat_mtimes(self):
+        return (os.stat(self.json_path).st_mtime_ns,
+                os.stat(self.weights_path).st_mtime_ns)
+
+    def _hash_files(self):
+        return model_files_version(self.json_path, self.weights_path)
+
+    def get(self):
+        mtimes = self._stat_mtimes()
+        if self._model is not None and mtimes == self._mtimes:
+            return self._model
+
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            mtimes = self._stat_mtimes()
+            if self._model is not None and mtimes == self._mtimes:
+                return self._model
+
+            version = self._hash_files()
+            if self.pinned_version and version != self.pinned_version:
+                message = (f"Model files are version {version[:12]}, but this server "
+                           f"serves {self.pinned_version[:12]}; restart it to roll out "
+                           f"the new model")
+                if self._model is None:
+                    raise ModelVersionError(message)
+                print(message, file=sys.stderr)
+            elif self._model is None or version != self.version:
+                with span('model_load'):
+                    model = load_model(self.json_path, self.weights_path)
+                    warm_up(model)
+                self._model = model
+                self.version = version
+                self.load_count += 1
+            self._mtimes = mtimes
+            return self._model
+
+
+_holder = ModelHolder()
+
+
+# Function to get the shared model, loading it on first use
+def get_model():
+    return _holder.get()
+
+
+# Function to make every later load in this process (and its forks) accept only one version
+def pin_model_version(version):
+    _holder.pinned_version = version
+
+
+# Function to get the version hash of the currently loaded model
+def get_model_version():
+    get_model()
+    return _holder.version
+
+
+_prewarm_thread = None
+_prewarm_lock = threading.Lock()
+
+
+# Function to load the shared model on a background thread (once per process)
+def start_prewarm(load=get_model):
+    global _prewarm_thread
+    with _prewarm_lock:
+        if _prewarm_thread is None:
+            _prewarm_thread = threading.Thread(
+                target=_prewarm, args=(load,), name='model-prewarm', daemon=True)
+            _prewarm_thread.start()
+
+
+def _prewarm(load):
+    try:
+        load()
+    except Exception as e:
+        # The page that needs the model reports the error to the user
+        print(f"Model prewarm failed: {e}", file=sys.stderr)
@@ -0,0 +1,110 @@
+"""Compare a converted model against the Keras model on sample images.
+
+Usage:
+    python parity.py SAMPLE_DIR --candidate model_int8.tflite [--min-top1 0.99] [--json report.json]
+
+Reports top-1 and top-3 agreement and per-class probability deltas, and
+exits non-zero if top-1 agreement is below ``--min-top1``, so a conversion
+that changes diagnoses cannot be rolled out silently. It also checks that
+the upload path (``decode_upload``) builds the same model input as the file
+path (``preprocess_image``) for every sample, and fails if any differ.
+Samples that cannot be decoded are skipped and listed in the report.
+"""
+import argparse
+import itertools
+import json
+import sys
+
+import numpy as np
+
+from inference import classes, iter_image_paths, iter_preprocessed_batches, preprocess_image
+from inference_backends import KerasBackend, TFLiteBackend
+from ingest import decode_upload
+
+
+# Function to find images whose upload and file paths give different model inputs
+def compare_preprocessing(paths):
+    """Return ``(mismatched paths, [(path, error)] for images that failed to decode)``."""
+    mismatches, failures = [], []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                _, model_input = decode_upload(f.read(), max_pixels=float('inf'))
+            same = np.array_equal(preprocess_image(model_input), preprocess_image(path))
+        except Exception as e:
+            failures.append((path, f"{type(e).__name__}: {e}"))
+            continue
+        if not same:
+            mismatches.append(path)
+    return mismatches, failures
+
+
+# Function to run both backends over the same images and compare their outputs
+def compare_backends(reference, candidate, images, batch_size=32):
+    ref_probs, cand_probs, skipped = [], [], []
+    for _, batch, failures in iter_preprocessed_batches(images, batch_size):
+        skipped.extend(failures)
+        if len(batch):
+            ref_probs.append(reference.predict(batch))
+            cand_probs.append(candidate.predict(batch))
+    if not ref_probs:
+        raise ValueError("No sample images to compare")
+    ref = np.concatenate(ref_probs)
+    cand = np.concatenate(cand_probs)
+
+    ref_top3 = np.argsort(-ref, axis=1)[:, :3]
+    cand_top3 = np.argsort(-cand, axis=1)[:, :3]
+    delta = np.abs(ref - cand)
+    return {
+        'images': len(ref),
+        'skipped': [{'path': path, 'error': error} for path, error in skipped],
+        'top1_agreement': float(np.mean(ref_top3[:, 0] == cand_top3[:, 0])),
+        # Same three classes in the same order
+        'top3_agreement': float(np.mean(np.all(ref_top3 == cand_top3, axis=1))),
+        # Reference top-1 still among the candidate's top 3
+        'top1_in_top3': float(np.mean(np.any(cand_top3 == ref_top3[:, :1], axis=1))),
+        'max_abs_delta': float(delta.max()),
+        'per_class': {
+            name: {'mean_abs_delta': float(delta[:, i].mean()),
+                   'max_abs_delta': float(delta[:, i].max())}
+            for i, name in enumerate(classes)
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sample_dir', help='directory of sample images')
+    parser.add_argument('--candidate', required=True, help='converted .tflite model')
+    parser.add_argument('--limit', type=int, help='compare at most this many images')
+    parser.add_argument('--min-top1', type=float, default=0.99,
+                        help='minimum top-1 agreement to pass')
+    parser.add_argument('--json', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    images = list(itertools.islice(iter_image_paths(args.sample_dir), args.limit))
+    mismatches, _ = compare_preprocessing(images)
+    report = compare_backends(KerasBackend(), TFLiteBackend(args.candidate), images)
+    report['preprocessing_mismatches'] = mismatches
+
+    print(f"Images: {report['images']}, skipped: {len(report['skipped'])}")
+    for skipped in report['skipped']:
+        print(f"  skipped {skipped['path']}: {skipped['error']}")
+    print(f"Top-1 agreement: {report['top1_agreement']:.2%}")
+    print(f"Top-3 agreement: {report['top3_agreement']:.2%} "
+          f"(reference top-1 in candidate top-3: {report['top1_in_top3']:.2%})")
+    print("Probability deltas (mean / max):")
+    for name, d in report['per_class'].items():
+        print(f"  {name:22s} {d['mean_abs_delta']:.4f} / {d['max_abs_delta']:.4f}")
+
+    for path in mismatches:
+        print(f"Upload and file preprocessing differ: {path}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report['top1_agreement'] >= args.min_top1 and not mismatches else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
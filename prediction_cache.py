@@ -0,0 +1,185 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from inference_backends import get_backend
+from inference import classes, top_k_predictions
+from scheduler import get_scheduler, schedule_probabilities
+from telemetry import register_collector
+
+
+# Location and limits of the prediction cache
+PREDICTION_CACHE_PATH = os.environ.get(
+    'SKIN_PREDICTION_CACHE', 'prediction_cache.sqlite3')
+MAX_MEMORY_ENTRIES = 1024
+MAX_DISK_ENTRIES = 100_000
+MAX_AGE_SECONDS = 30 * 24 * 3600
+# Prune the disk tier once every this many writes
+PRUNE_EVERY = 256
+
+
+# Function to build the cache key for an image under a given model version
+def cache_key(image_bytes, model_version):
+    digest = hashlib.sha256(image_bytes)
+    digest.update(b'\0')
+    digest.update(model_version.encode())
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """Two-tier cache of class probabilities keyed by image and model hash.
+
+    Lookups go to a bounded in-memory LRU first, then to a SQLite table that
+    survives restarts. Disk hits are promoted into memory. Both tiers drop
+    entries older than ``max_age``; the disk tier is pruned to
+    ``max_disk_entries`` by age every ``PRUNE_EVERY`` writes. Pass
+    ``db_path=None`` for a memory-only cache.
+    """
+
+    def __init__(self, db_path=PREDICTION_CACHE_PATH, max_memory_entries=MAX_MEMORY_ENTRIES,
+                 max_disk_entries=MAX_DISK_ENTRIES, max_age=MAX_AGE_SECONDS):
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_age = max_age
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                'key TEXT PRIMARY KEY, probs BLOB NOT NULL, created REAL NOT NULL)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS predictions_created ON predictions (created)')
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self.max_age:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return entry[0]
+            if entry is not None:
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT probs, created FROM predictions WHERE key = ?', (key,)).fetchone()
+                if row is not None and now - row[1] <= self.max_age:
+                    probs = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, probs, row[1])
+                    self.hits_disk += 1
+                    return probs
+
+            self.misses += 1
+            return None
+
+    def put(self, key, probs):
+        probs = np.asarray(probs, dtype=np.float32)
+        created = time.time()
+        with self._lock:
+            self._remember(key, probs, created)
+            if self._db is None:
+                return
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO predictions (key, probs, created) VALUES (?, ?, ?)',
+                    (key, probs.tobytes(), created))
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune(created)
+
+    def _remember(self, key, probs, created):
+        self._memory[key] = (probs, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _prune(self, now):
+        with self._db:
+            self._db.execute(
+                'DELETE FROM predictions WHERE created < ?', (now - self.max_age,))
+            self._db.execute(
+                'DELETE FROM predictions WHERE key IN ('
+                'SELECT key FROM predictions ORDER BY created DESC LIMIT -1 OFFSET ?)',
+                (self.max_disk_entries,))
+
+    def stats(self):
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            'hits_memory': self.hits_memory,
+            'hits_disk': self.hits_disk,
+            'misses': self.misses,
+            'hit_rate': (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Function to get the process-wide prediction cache
+def get_prediction_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PredictionCache()
+            register_collector(_cache_gauges)
+        return _cache
+
+
+def _cache_gauges():
+    stats = _cache.stats()
+    return {
+        'skin_prediction_cache_hits': ('Prediction cache hits (memory and disk)',
+                                       stats['hits_memory'] + stats['hits_disk']),
+        'skin_prediction_cache_misses': ('Prediction cache misses', stats['misses']),
+        'skin_prediction_cache_hit_rate': ('Fraction of lookups served from the cache',
+                                           stats['hit_rate']),
+    }
+
+
+# Function to predict uploads, reusing cached results for images seen before
+def cached_predictions(images_bytes, model_inputs, k=3, cache=None, embeddings=False):
+    """Return top-k results, or ``(results, embeddings)`` with ``embeddings=True``.
+
+    With embeddings each cached row holds the class probabilities followed by
+    the penultimate-layer embedding, under its own key so probability-only
+    entries are not mistaken for it.
+    """
+    cache = cache or get_prediction_cache()
+    version = get_backend().version
+    if embeddings:
+        version += ':embeddings'
+    keys = [cache_key(data, version) for data in images_bytes]
+    rows = [cache.get(key) for key in keys]
+
+    missing = [i for i, r in enumerate(rows) if r is None]
+    if missing:
+        scheduler = get_scheduler('embeddings' if embeddings else 'probabilities')
+        computed = schedule_probabilities([model_inputs[i] for i in missing], scheduler)
+        for i, row in zip(missing, computed):
+            cache.put(keys[i], row)
+            rows[i] = row
+
+    if not rows:
+        return ([], np.empty((0, 0), dtype=np.float32)) if embeddings else []
+    rows = np.stack(rows)
+    results = top_k_predictions(rows[:, :len(classes)], k)
+    if embeddings:
+        return results, rows[:, len(classes):]
+    return results
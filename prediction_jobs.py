@@ -0,0 +1,174 @@
+"""Background prediction jobs that outlive a Streamlit rerun.
+
+The Check Disease page submits one job per uploaded image and polls it on
+later reruns instead of blocking the script thread, so a widget interaction
+while the model runs no longer throws the work away. Jobs are keyed by
+(session id, image hash, explain): submitting the same image again from the
+same session returns the job already queued, running or finished, while a
+request for heatmaps never picks up a job that computes none. Finished jobs
+that nobody collects are dropped after ``JOB_TTL_SECONDS``.
+"""
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from explain import cached_explanations
+from inference_backends import get_backend
+from prediction_cache import cached_predictions
+from similar_cases import SIMILAR_CASES, get_similar_index
+from telemetry import register_collector, span
+
+
+# Jobs run at once; they mostly wait on the micro-batching scheduler
+MAX_JOB_WORKERS = int(os.environ.get('SKIN_JOB_WORKERS', 8))
+# Finished jobs are kept this long for a session to collect them
+JOB_TTL_SECONDS = 600
+
+
+# Function to hash an uploaded image for job and session-state keys
+def image_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+# Function to look up similar cases, returning None instead of failing the prediction
+def find_similar_cases(index, embedding, model_version):
+    try:
+        with span('similar_cases'):
+            return index.search(embedding, SIMILAR_CASES, model_version=model_version)[0]
+    except Exception as e:
+        print(f"Similar cases skipped: {e}", file=sys.stderr)
+        return None
+
+
+# Function to predict one decoded upload, plus its similar cases when an index exists
+def run_prediction(image_bytes, model_input, explain=False):
+    """Return ``(result, similar cases or None, Grad-CAM heatmaps or None)``."""
+    backend = get_backend()
+    # Similar cases and heatmaps need the Keras model's forward pass
+    keras = backend.name == 'keras'
+    index = get_similar_index() if keras else None
+    heatmaps = None
+    if explain and keras:
+        results, embeddings, heatmaps = cached_explanations([image_bytes], [model_input])
+        heatmaps = heatmaps[0]
+    elif index is not None:
+        results, embeddings = cached_predictions([image_bytes], [model_input], embeddings=True)
+    else:
+        return cached_predictions([image_bytes], [model_input])[0], None, None
+    if index is None:
+        return results[0], None, heatmaps
+    return results[0], find_similar_cases(index, embeddings[:1], backend.version), heatmaps
+
+
+class PredictionJob:
+    def __init__(self, key, future):
+        self.key = key
+        self.future = future
+        self.submitted = time.time()
+        self.finished = None
+        self.cancelled = False
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        self.finished = time.time()
+
+    @property
+    def status(self):
+        if self.cancelled or self.future.cancelled():
+            return 'cancelled'
+        if self.future.running():
+            return 'running'
+        if not self.future.done():
+            return 'queued'
+        return 'failed' if self.future.exception() is not None else 'done'
+
+    def result(self):
+        return self.future.result()
+
+    def cancel(self):
+        """Cancel the job; a forward pass already running finishes but its result is dropped."""
+        self.cancelled = True
+        self.future.cancel()
+
+
+class JobManager:
+    """Process-wide executor of prediction jobs keyed by (session id, image hash, explain)."""
+
+    def __init__(self, max_workers=MAX_JOB_WORKERS, ttl=JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='prediction-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, image_bytes, model_input, explain=False, fn=run_prediction):
+        key = (session_id, image_hash(image_bytes), bool(explain))
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(key)
+            # Resubmitting retries a failed or cancelled job
+            if job is None or job.status in ('failed', 'cancelled'):
+                job = PredictionJob(
+                    key, self._executor.submit(fn, image_bytes, model_input, explain))
+                self._jobs[key] = job
+            return job
+
+    def get(self, session_id, hash_, explain=False):
+        with self._lock:
+            return self._jobs.get((session_id, hash_, bool(explain)))
+
+    # Function to take a finished job out of the manager once its result is stored elsewhere
+    def collect(self, session_id, hash_, explain=False):
+        key = (session_id, hash_, bool(explain))
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.status in ('done', 'failed', 'cancelled'):
+                del self._jobs[key]
+            return job
+
+    def cancel(self, session_id, hashes=None):
+        with self._lock:
+            for key, job in list(self._jobs.items()):
+                job_session, hash_, _ = key
+                if job_session == session_id and (hashes is None or hash_ in hashes):
+                    job.cancel()
+                    del self._jobs[key]
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for key, job in list(self._jobs.items()):
+            if job.finished is not None and job.finished < cutoff:
+                del self._jobs[key]
+
+    def counts(self):
+        with self._lock:
+            counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0, 'cancelled': 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+# Function to get the process-wide job manager shared by all sessions
+def get_job_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+            register_collector(_job_gauges)
+        return _manager
+
+
+def _job_gauges():
+    counts = _manager.counts()
+    return {
+        'skin_prediction_jobs_queued': ('Prediction jobs waiting for a worker',
+                                        counts['queued']),
+        'skin_prediction_jobs_running': ('Prediction jobs running', counts['running']),
+    }
+
@@ -0,0 +1,200 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from inference_backends import get_backend
+from thread_tuning import get_thread_config
+from telemetry import observe, register_collector, span
+from inference import classes, preprocess_image
+
+
+# Defaults for the batching window, overridable from the environment
+BATCH_WINDOW_MS = float(os.environ.get('SKIN_BATCH_WINDOW_MS', 10))
+MAX_BATCH_SIZE = int(os.environ.get('SKIN_MAX_BATCH_SIZE', 32))
+
+
+class MicroBatchScheduler:
+    """Background worker that merges concurrent predict requests into batches.
+
+    Callers submit single preprocessed images and get a ``Future`` back. The
+    worker waits for the first request, then keeps collecting until either
+    ``window_ms`` has passed since that request arrived or ``max_batch_size``
+    requests are pending, runs one forward pass and resolves every future
+    with its row of class probabilities. With ``workers`` > 1 that many
+    batches can be in flight at once.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=MAX_BATCH_SIZE,
+                 window_ms=BATCH_WINDOW_MS, wait_samples=1000, workers=1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._waits = deque(maxlen=wait_samples)
+        self._requests = 0
+
+    def start(self):
+        with self._start_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._run, name='inference-scheduler', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, image):
+        self.start()
+        future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        pending = [first]
+        deadline = first[2] + self.window
+        while len(pending) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Serve what we have, then let the next loop see the stop signal
+                self._queue.put(None)
+                break
+            pending.append(item)
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            if pending is None:
+                return
+            # Drop requests whose caller cancelled while they were queued
+            pending = [p for p in pending if p[1].set_running_or_notify_cancel()]
+            if not pending:
+                continue
+
+            started = time.perf_counter()
+            with self._stats_lock:
+                self._batch_sizes[len(pending)] += 1
+                self._requests += len(pending)
+                self._waits.extend(started - p[2] for p in pending)
+            for p in pending:
+                observe('skin_stage_seconds', 'queue_wait', started - p[2])
+
+            try:
+                with span('model_forward'):
+                    probs = self.predict_fn(np.stack([p[0] for p in pending]))
+            except Exception as e:
+                for _, future, _ in pending:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), row in zip(pending, probs):
+                future.set_result(row)
+
+    def stats(self):
+        with self._stats_lock:
+            waits_ms = np.array(self._waits) * 1000.0
+            return {
+                'queue_depth': self._queue.qsize(),
+                'requests': self._requests,
+                'batches': sum(self._batch_sizes.values()),
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'wait_ms_mean': float(waits_ms.mean()) if len(waits_ms) else 0.0,
+                'wait_ms_p95': float(np.percentile(waits_ms, 95)) if len(waits_ms) else 0.0,
+                'wait_ms_max': float(waits_ms.max()) if len(waits_ms) else 0.0,
+            }
+
+
+# Function to run a batch through the configured inference backend
+def _predict_with_shared_model(batch):
+    return get_backend().predict(batch)
+
+
+# Function to run a batch and return each row as probabilities followed by the embedding
+def _predict_with_embeddings(batch):
+    probs, embeddings = get_backend().predict_with_embeddings(batch)
+    return np.hstack([probs, embeddings])
+
+
+# Function to run a batch and return each row as probabilities, embedding and flat heatmaps
+def _predict_with_explanations(batch):
+    probs, embeddings, heatmaps = get_backend().predict_with_explanations(batch)
+    return np.hstack([probs, embeddings, heatmaps.reshape(len(heatmaps), -1)])
+
+
+# What each row of a scheduler's results holds
+SCHEDULER_OUTPUTS = {
+    'probabilities': _predict_with_shared_model,
+    'embeddings': _predict_with_embeddings,
+    'explanations': _predict_with_explanations,
+}
+
+_schedulers = {}
+_scheduler_lock = threading.Lock()
+
+
+# Function to get the process-wide scheduler shared by all sessions
+def get_scheduler(outputs='probabilities'):
+    with _scheduler_lock:
+        if outputs not in _schedulers:
+            _schedulers[outputs] = MicroBatchScheduler(
+                SCHEDULER_OUTPUTS[outputs], workers=get_thread_config()['inference_slots'])
+            if len(_schedulers) == 1:
+                register_collector(_scheduler_gauges)
+        return _schedulers[outputs]
+
+
+# Function to report every scheduler's stats, labelled by what it outputs
+def _scheduler_gauges():
+    with _scheduler_lock:
+        schedulers = dict(_schedulers)
+    queue_depth, batches, requests, batch_sizes = [], [], [], []
+    for outputs, scheduler in sorted(schedulers.items()):
+        stats = scheduler.stats()
+        labels = {'scheduler': outputs}
+        queue_depth.append((labels, stats['queue_depth']))
+        batches.append((labels, stats['batches']))
+        requests.append((labels, stats['requests']))
+        batch_sizes.extend((dict(labels, size=size), count)
+                           for size, count in stats['batch_size_histogram'].items())
+    return {
+        'skin_scheduler_queue_depth': ('Predict requests waiting for a batch', queue_depth),
+        'skin_scheduler_batches': ('Batches run by the scheduler', batches),
+        'skin_scheduler_requests': ('Images predicted by the scheduler', requests),
+        'skin_scheduler_batch_size': ('Batches run by the scheduler, by number of images',
+                                      batch_sizes),
+    }
+
+
+# Function to get class probabilities for images through the shared scheduler
+def schedule_probabilities(paths_or_arrays, scheduler=None):
+    scheduler = scheduler or get_scheduler()
+    with span('preprocess'):
+        images = [preprocess_image(item) for item in paths_or_arrays]
+    futures = [scheduler.submit(image) for image in images]
+    if not futures:
+        return np.empty((0, len(classes)), dtype='float32')
+    return np.stack([future.result() for future in futures])
@@ -0,0 +1,170 @@
+"""Headless HTTP inference service and the HTML pages in templates/.
+
+Run with several pre-forked workers:
+    gunicorn -c gunicorn.conf.py server:app
+or a single development process:
+    python server.py
+
+Endpoints:
+    POST /api/predict        multipart ``file``  -> top-3 JSON for one image
+    POST /api/predict/batch  multipart ``files`` -> list of top-3 JSON
+    POST /success            form upload from service.html, renders success.html
+    GET  /healthz
+"""
+import base64
+import io
+import os
+
+from flask import Flask, jsonify, render_template, request
+
+from inference_backends import get_backend
+from model_loader import model_files_version, pin_model_version
+from ingest import InvalidImageError, decode_upload
+from prediction_cache import cached_predictions
+
+
+# Largest request body accepted, in bytes
+MAX_UPLOAD_BYTES = int(os.environ.get('SKIN_MAX_UPLOAD_BYTES', 64 * 1024 * 1024))
+# Largest number of images in one batch request
+MAX_BATCH_FILES = int(os.environ.get('SKIN_MAX_BATCH_FILES', 64))
+
+app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+
+class BadImageError(ValueError):
+    pass
+
+
+# Function to load what can be shared with forked workers before gunicorn forks
+def preload():
+    """Called in the gunicorn master when ``preload_app`` is on.
+
+    A TFLite model is loaded and warmed up here: the interpreter maps the
+    model file, so every worker shares the weight pages. The TensorFlow
+    eager runtime is not fork-safe (workers hang on their first predict if
+    the parent has loaded a Keras model), so for the Keras backend only the
+    TensorFlow modules are imported here and each worker loads the model in
+    ``post_fork``, after checking that its model files still hash to the
+    version recorded here, so no two workers serve different models.
+    """
+    backend = get_backend()
+    if backend.name == 'tflite':
+        backend.load()
+    else:
+        import tensorflow  # noqa: F401
+        pin_model_version(model_files_version())
+
+
+# Function to decode uploaded files and predict them in one scheduler round
+def predict_uploads(files, thumbnails=False):
+    """Return ``(images_bytes, thumbnails, results)``; thumbnails are None unless asked for."""
+    images_bytes, thumbnail_list, model_inputs = [], [], []
+    for file in files:
+        data = file.read()
+        try:
+            thumbnail, model_input = decode_upload(data, thumbnail=thumbnails)
+        except InvalidImageError as e:
+            raise BadImageError(f"{file.filename}: {e}") from e
+        images_bytes.append(data)
+        thumbnail_list.append(thumbnail)
+        model_inputs.append(model_input)
+    return images_bytes, thumbnail_list, cached_predictions(images_bytes, model_inputs)
+
+
+# Function to embed the display thumbnail in the page, so no upload is written to disk
+def thumbnail_data_uri(thumbnail):
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, 'JPEG', quality=90)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def prediction_json(filename, result):
+    top_classes, top_probs, top_class, top_prob = result
+    return {
+        'filename': filename,
+        'predictions': [{'class': c, 'percent': round(float(p), 2)}
+                        for c, p in zip(top_classes, top_probs)],
+        'top_class': top_class,
+        'top_probability': float(top_prob),
+    }
+
+
+@app.route('/')
+def home():
+    return render_template('index.html')
+
+
+@app.route('/about')
+def about():
+    return render_template('about.html')
+
+
+@app.route('/service')
+def service():
+    return render_template('service.html')
+
+
+@app.route('/contact')
+def contact():
+    return render_template('contact.html')
+
+
+@app.route('/success', methods=['POST'])
+def success():
+    file = request.files.get('file')
+    if file is None or not file.filename:
+        return render_template('service.html', error="Please choose an image to upload.")
+    try:
+        _, thumbnails, results = predict_uploads([file], thumbnails=True)
+    except BadImageError as e:
+        return render_template('service.html', error=str(e))
+
+    top_classes, top_probs, _, _ = results[0]
+    predictions = {}
+    for i, (c, p) in enumerate(zip(top_classes, top_probs), start=1):
+        predictions[f'class{i}'] = c
+        predictions[f'prob{i}'] = p
+    return render_template('success.html', img=thumbnail_data_uri(thumbnails[0]),
+                           predictions=predictions)
+
+
+@app.route('/api/predict', methods=['POST'])
+def api_predict():
+    file = request.files.get('file')
+    if file is None:
+        return jsonify(error="Missing multipart field 'file'."), 400
+    try:
+        _, _, results = predict_uploads([file])
+    except BadImageError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(prediction_json(file.filename, results[0]))
+
+
+@app.route('/api/predict/batch', methods=['POST'])
+def api_predict_batch():
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify(error="Missing multipart field 'files'."), 400
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify(error=f"At most {MAX_BATCH_FILES} files per request."), 400
+    try:
+        _, _, results = predict_uploads(files)
+    except BadImageError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify([prediction_json(f.filename, r) for f, r in zip(files, results)])
+
+
+@app.route('/healthz')
+def healthz():
+    return jsonify(status='ok', model=get_backend().version)
+
+
+@app.errorhandler(413)
+def too_large(e):
+    return jsonify(error=f"Request larger than {MAX_UPLOAD_BYTES} bytes."), 413
+
+
+if __name__ == '__main__':
+    get_backend().load()
+    app.run(host='127.0.0.1', port=int(os.environ.get('PORT', 5000)), threaded=True)
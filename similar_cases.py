@@ -0,0 +1,440 @@
+"""Find previously diagnosed images that look like a new one.
+
+Usage:
+    python similar_cases.py add INDEX_DIR LABELED_DIR_OR_CSV [--image-dir DIR]
+    python similar_cases.py add INDEX_DIR IMAGES_DIR_OR_LIST --unlabeled
+    python similar_cases.py build-pq INDEX_DIR [--subspaces 8]
+    python similar_cases.py query INDEX_DIR IMAGE [-k 5]
+
+Images are compared by cosine similarity of the model's penultimate-layer
+embedding, computed in the same forward pass as the class probabilities.
+An index directory holds:
+
+    index.json      dimension, row count and model version; rewritten
+                    atomically after each append, so it is the commit point
+    vectors.f32     L2-normalised float32 rows, appended in place
+    meta.jsonl      one JSON object (path, label) per row
+    meta.offsets    uint64 byte offset of each row in meta.jsonl
+    pq.npy          optional product-quantization codebooks
+    codes.u8        optional uint8 PQ codes, one row per vector
+
+Vectors and codes are memory-mapped and scanned in chunks, so a query
+never loads the whole index into RAM. With PQ codes the scan reads
+``subspaces`` bytes per image instead of ``4 * dim`` and the best
+candidates are re-ranked against the exact vectors.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+from inference import DEFAULT_BATCH_SIZE, classes, iter_preprocessed_batches, preprocess_image
+
+
+# Index used by the app; empty disables similar cases
+SIMILAR_INDEX_PATH = os.environ.get('SKIN_SIMILAR_INDEX', 'similar_index')
+# Similar cases shown per upload
+SIMILAR_CASES = 5
+# Rows scored per matrix product while scanning the index
+SCAN_CHUNK_ROWS = 65536
+# PQ candidates re-ranked exactly, per result requested
+RERANK_FACTOR = 10
+
+
+# Function to L2-normalise rows so a dot product is the cosine similarity
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# Function to merge a chunk's scores into the running top-k of each query
+def _merge_top_k(best_scores, best_ids, scores, offset, k):
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = part + offset
+    else:
+        ids = np.broadcast_to(np.arange(scores.shape[1]) + offset, scores.shape)
+    scores = np.concatenate([best_scores, scores], axis=1)
+    ids = np.concatenate([best_ids, ids], axis=1)
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    return scores, ids
+
+
+# Function to run k-means on the rows of data with numpy
+def kmeans(data, n_clusters, iterations=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        distances = ((data ** 2).sum(axis=1, keepdims=True) - 2 * data @ centroids.T
+                     + (centroids ** 2).sum(axis=1))
+        assignment = distances.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        # Empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class ProductQuantizer:
+    """Splits vectors into ``subspaces`` parts, each coded by one of 256 centroids."""
+
+    def __init__(self, codebooks):
+        # (subspaces, centroids, dim // subspaces)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+
+    @classmethod
+    def train(cls, vectors, subspaces=8, iterations=20):
+        dim = vectors.shape[1]
+        if dim % subspaces:
+            raise ValueError(f"Embedding size {dim} is not divisible by {subspaces} subspaces")
+        n_clusters = min(256, len(vectors))
+        sub_dim = dim // subspaces
+        return cls([kmeans(vectors[:, j * sub_dim:(j + 1) * sub_dim], n_clusters, iterations)
+                    for j in range(subspaces)])
+
+    def encode(self, vectors):
+        subspaces, _, sub_dim = self.codebooks.shape
+        codes = np.empty((len(vectors), subspaces), dtype=np.uint8)
+        for j, codebook in enumerate(self.codebooks):
+            part = vectors[:, j * sub_dim:(j + 1) * sub_dim]
+            distances = -2 * part @ codebook.T + (codebook ** 2).sum(axis=1)
+            codes[:, j] = distances.argmin(axis=1)
+        return codes
+
+    # Function to build per-query lookup tables of subspace inner products
+    def lookup_tables(self, queries):
+        subspaces, _, sub_dim = self.codebooks.shape
+        parts = queries.reshape(len(queries), subspaces, sub_dim)
+        return np.einsum('qjd,jcd->qjc', parts, self.codebooks)
+
+    # Function to approximate the inner products of queries with coded rows
+    def scores(self, tables, codes):
+        subspaces = codes.shape[1]
+        scores = np.zeros((len(tables), len(codes)), dtype=np.float32)
+        for j in range(subspaces):
+            scores += np.take(tables[:, j], np.ascontiguousarray(codes[:, j]), axis=1)
+        return scores
+
+
+class IndexMismatchError(ValueError):
+    pass
+
+
+class EmbeddingIndex:
+    """Append-only, memory-mapped index of normalised embeddings and metadata.
+
+    ``add`` appends vectors and metadata, then commits by rewriting
+    ``index.json``; rows past the committed count (from an interrupted add)
+    are ignored and overwritten by the next add. ``search`` picks up rows
+    added by other processes since the last call.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._header_mtime = -1
+        self._refresh()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def exists(directory):
+        return bool(directory) and os.path.exists(os.path.join(directory, 'index.json'))
+
+    def _refresh(self):
+        header_path = self._path('index.json')
+        mtime = os.stat(header_path).st_mtime_ns if os.path.exists(header_path) else None
+        if mtime == self._header_mtime:
+            return
+        header = {'dim': None, 'count': 0, 'model_version': None}
+        if mtime is not None:
+            with open(header_path) as f:
+                header.update(json.load(f))
+        self.dim = header['dim']
+        self.count = header['count']
+        self.model_version = header['model_version']
+        self._vectors = self._map('vectors.f32', np.float32, self.dim)
+        self._offsets = self._map('meta.offsets', np.uint64, None)
+        self.pq = None
+        self._codes = None
+        if os.path.exists(self._path('pq.npy')):
+            self.pq = ProductQuantizer(np.load(self._path('pq.npy')))
+            self._codes = self._map('codes.u8', np.uint8, self.pq.codebooks.shape[0])
+        self._header_mtime = mtime
+
+    # Function to memory-map the committed rows of one of the index files
+    def _map(self, name, dtype, width):
+        if not self.count:
+            return None
+        shape = (self.count, width) if width else (self.count,)
+        return np.memmap(self._path(name), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, embeddings, metadata, model_version=None):
+        vectors = normalize(embeddings)
+        if len(vectors) != len(metadata):
+            raise ValueError("Need one metadata entry per embedding")
+        with self._lock:
+            self._refresh()
+            if self.dim is not None and vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding size {vectors.shape[1]} does not match "
+                                 f"the index ({self.dim})")
+            if (self.model_version and model_version
+                    and model_version != self.model_version):
+                raise ValueError(f"Index was built with model {self.model_version}, "
+                                 f"not {model_version}; rebuild it for the new model")
+            os.makedirs(self.directory, exist_ok=True)
+            count = self.count
+
+            self._append('vectors.f32', vectors.tobytes(), count * vectors.shape[1] * 4)
+            meta_end = self._truncate('meta.jsonl', self._meta_end(count))
+            offsets, lines = [], []
+            for entry in metadata:
+                offsets.append(meta_end)
+                line = (json.dumps(entry) + '\n').encode()
+                lines.append(line)
+                meta_end += len(line)
+            self._append('meta.jsonl', b''.join(lines), None)
+            self._append('meta.offsets', np.array(offsets, dtype=np.uint64).tobytes(),
+                         count * 8)
+            if self.pq is not None:
+                self._append('codes.u8', self.pq.encode(vectors).tobytes(),
+                             count * self.pq.codebooks.shape[0])
+
+            self._write_header({
+                'dim': int(vectors.shape[1]),
+                'count': count + len(vectors),
+                'model_version': self.model_version or model_version,
+            })
+            self._refresh()
+
+    # Function to find where the metadata of row ``count`` starts
+    def _meta_end(self, count):
+        if not count:
+            return 0
+        with open(self._path('meta.jsonl'), 'rb') as f:
+            f.seek(int(self._offsets[count - 1]))
+            f.readline()
+            return f.tell()
+
+    def _truncate(self, name, size):
+        path = self._path(name)
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+        return size
+
+    def _append(self, name, data, committed_size):
+        if committed_size is not None:
+            self._truncate(name, committed_size)
+        with open(self._path(name), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_header(self, header):
+        tmp_path = self._path('index.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path('index.json'))
+
+    # Function to read the metadata of one row without loading the rest
+    def metadata(self, row):
+        with open(self._path('meta.jsonl'), 'rb') as f:
+            f.seek(int(self._offsets[row]))
+            return json.loads(f.readline())
+
+    def paths(self):
+        if not self.count:
+            return set()
+        with open(self._path('meta.jsonl')) as f:
+            return {json.loads(line)['path'] for line, _ in zip(f, range(self.count))}
+
+    # Function to train PQ codebooks on a sample of the index and code every row
+    def build_pq(self, subspaces=8, train_size=100_000, iterations=20, seed=0):
+        with self._lock:
+            self._refresh()
+            if not self.count:
+                raise ValueError("Index is empty")
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(self.count, min(train_size, self.count), replace=False))
+            pq = ProductQuantizer.train(np.asarray(self._vectors[sample]), subspaces, iterations)
+            tmp_path = self._path('codes.u8.tmp')
+            with open(tmp_path, 'wb') as f:
+                for start in range(0, self.count, SCAN_CHUNK_ROWS):
+                    f.write(pq.encode(np.asarray(
+                        self._vectors[start:start + SCAN_CHUNK_ROWS])).tobytes())
+            np.save(self._path('pq.npy'), pq.codebooks)
+            os.replace(tmp_path, self._path('codes.u8'))
+            # Touch the header so other processes remap the new codes
+            self._write_header({'dim': self.dim, 'count': self.count,
+                                'model_version': self.model_version})
+            self._refresh()
+
+    def search(self, embeddings, k=5, exact=False, model_version=None):
+        """Return, per query, a list of ``(similarity, metadata)`` best first.
+
+        Raises ``IndexMismatchError`` when the embeddings cannot be compared
+        with the index: a different size, or a ``model_version`` other than
+        the one the index was built with.
+        """
+        queries = normalize(np.atleast_2d(embeddings))
+        with self._lock:
+            self._refresh()
+            vectors, codes, pq, count = self._vectors, self._codes, self.pq, self.count
+            index_version = self.model_version
+        if not count:
+            return [[] for _ in queries]
+        if queries.shape[1] != self.dim:
+            raise IndexMismatchError(f"Embedding size {queries.shape[1]} does not match "
+                                     f"the index ({self.dim})")
+        if model_version and index_version and model_version != index_version:
+            raise IndexMismatchError(f"Index was built with model {index_version}, "
+                                     f"not {model_version}; rebuild it for the new model")
+
+        k = min(k, count)
+        if pq is None or exact:
+            scores, ids = self._scan(queries, k, lambda rows: queries @ np.asarray(rows).T,
+                                     vectors, count)
+        else:
+            tables = pq.lookup_tables(queries)
+            _, candidates = self._scan(
+                queries, min(k * RERANK_FACTOR, count),
+                lambda rows: pq.scores(tables, np.asarray(rows)), codes, count)
+            # Re-rank the PQ candidates against the exact vectors
+            scores, ids = [], []
+            for query, rows in zip(queries, candidates):
+                rows = np.sort(rows)
+                exact_scores = np.asarray(vectors[rows]) @ query
+                best = np.argpartition(-exact_scores, k - 1)[:k]
+                scores.append(exact_scores[best])
+                ids.append(rows[best])
+            scores, ids = np.array(scores), np.array(ids)
+
+        results = []
+        for query_scores, query_ids in zip(scores, ids):
+            order = np.argsort(-query_scores)
+            results.append([(float(query_scores[i]), self.metadata(query_ids[i]))
+                            for i in order])
+        return results
+
+    @staticmethod
+    def _scan(queries, k, score_fn, rows, count):
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, count, SCAN_CHUNK_ROWS):
+            scores = score_fn(rows[start:start + SCAN_CHUNK_ROWS])
+            best_scores, best_ids = _merge_top_k(best_scores, best_ids, scores, start, k)
+        return best_scores, best_ids
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# Function to get the process-wide similar-case index, or None if none was built
+def get_similar_index():
+    global _index
+    with _index_lock:
+        if _index is None and EmbeddingIndex.exists(SIMILAR_INDEX_PATH):
+            _index = EmbeddingIndex(SIMILAR_INDEX_PATH)
+        return _index
+
+
+def _add(args):
+    from bulk_scan import iter_inputs
+    from evaluate import load_labels
+    from inference_backends import get_backend
+
+    if args.unlabeled:
+        labels = {path: None for path in iter_inputs(args.source)}
+    else:
+        labels = {path: classes[i] for path, i in load_labels(args.source, args.image_dir)}
+    index = EmbeddingIndex(args.index)
+    done = index.paths()
+    backend = get_backend()
+    backend.load()
+
+    added = failed = 0
+    for paths, batch, failures in iter_preprocessed_batches(
+            (p for p in labels if p not in done), args.batch_size, args.workers):
+        failed += len(failures)
+        if paths:
+            _, embeddings = backend.predict_with_embeddings(batch)
+            index.add(embeddings, [{'path': p, 'label': labels[p]} for p in paths],
+                      backend.version)
+            added += len(paths)
+        print(f"\r{added} added, {failed} failed", end='', file=sys.stderr)
+    print(f"\nIndex has {len(index)} images", file=sys.stderr)
+    return 0
+
+
+def _build_pq(args):
+    index = EmbeddingIndex(args.index)
+    index.build_pq(args.subspaces, args.train_size, args.iterations)
+    print(f"Coded {len(index)} images with {args.subspaces} bytes each", file=sys.stderr)
+    return 0
+
+
+def _query(args):
+    from inference_backends import get_backend
+
+    backend = get_backend()
+    probs, embeddings = backend.predict_with_embeddings(
+        np.expand_dims(preprocess_image(args.image), axis=0))
+    print(f"Predicted: {classes[int(probs[0].argmax())]}")
+    index = EmbeddingIndex(args.index)
+    for similarity, meta in index.search(embeddings, args.k, args.exact, backend.version)[0]:
+        print(f"{similarity:.3f}  {meta.get('label') or '-':22s} {meta['path']}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='embed images and append them to the index')
+    add.add_argument('index', help='index directory')
+    add.add_argument('source', help='labeled directory or CSV (or images with --unlabeled)')
+    add.add_argument('--image-dir', help='directory CSV paths are relative to')
+    add.add_argument('--unlabeled', action='store_true',
+                     help='source is an image directory, list file or - without labels')
+    add.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    add.add_argument('--workers', type=int, default=os.cpu_count(),
+                     help='decode/preprocess workers')
+    add.set_defaults(run=_add)
+
+    build_pq = commands.add_parser('build-pq', help='train PQ codes for fast approximate search')
+    build_pq.add_argument('index', help='index directory')
+    build_pq.add_argument('--subspaces', type=int, default=8, help='bytes per coded image')
+    build_pq.add_argument('--train-size', type=int, default=100_000)
+    build_pq.add_argument('--iterations', type=int, default=20)
+    build_pq.set_defaults(run=_build_pq)
+
+    query = commands.add_parser('query', help='list the images most similar to one image')
+    query.add_argument('index', help='index directory')
+    query.add_argument('image')
+    query.add_argument('-k', type=int, default=5)
+    query.add_argument('--exact', action='store_true', help='skip PQ and scan every vector')
+    query.set_defaults(run=_query)
+
+    args = parser.parse_args()
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
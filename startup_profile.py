@@ -0,0 +1,99 @@
+"""Report how long the app takes to import and to load the model.
+
+Usage:
+    python startup_profile.py [--top 15] [--with-model] [--json report.json]
+
+The import profile is taken in a fresh interpreter with ``-X importtime`` for
+the modules ``app.py`` imports at boot. Any heavy module from
+``HEAVY_MODULES`` that shows up there is reported as a regression, since those
+are only meant to load on the "Check Disease" page.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+# Modules app.py imports before rendering the first page
+BOOT_MODULES = ['streamlit', 'PIL', 'numpy', 'model_loader', 'inference_backends',
+                'prediction_jobs', 'explain', 'ingest', 'user_store', 'telemetry']
+# Modules that must not be imported at boot
+HEAVY_MODULES = ['tensorflow', 'keras', 'pandas']
+
+
+# Function to import the boot modules in a clean interpreter and parse -X importtime
+def profile_imports(modules=BOOT_MODULES):
+    here = os.path.dirname(os.path.abspath(__file__))
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + ', '.join(modules)],
+        cwd=here, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self_ms': int(self_us) / 1000.0,
+            'cumulative_ms': int(cumulative_us) / 1000.0,
+        })
+    return wall, entries
+
+
+# Function to time loading and warming up the shared model in this process
+def profile_model_load():
+    from model_loader import get_model
+    started = time.perf_counter()
+    get_model()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, default=15,
+                        help='number of slowest top-level imports to show')
+    parser.add_argument('--with-model', action='store_true',
+                        help='also time loading and warming up the model')
+    parser.add_argument('--json', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    wall, entries = profile_imports()
+    top_level = sorted((e for e in entries if e['depth'] == 0),
+                       key=lambda e: e['cumulative_ms'], reverse=True)
+    imported = {e['module'] for e in entries}
+    heavy = [m for m in HEAVY_MODULES if m in imported]
+
+    print(f"Boot imports: {wall * 1000:.0f} ms wall, "
+          f"{sum(e['cumulative_ms'] for e in top_level):.0f} ms in imports")
+    for e in top_level[:args.top]:
+        print(f"  {e['cumulative_ms']:9.1f} ms  {e['module']}")
+    if heavy:
+        print(f"REGRESSION: heavy modules imported at boot: {', '.join(heavy)}")
+
+    report = {
+        'boot_wall_ms': wall * 1000,
+        'imports': top_level,
+        'heavy_modules_at_boot': heavy,
+    }
+    if args.with_model:
+        load = profile_model_load()
+        print(f"Model load + warm-up: {load * 1000:.0f} ms")
+        report['model_load_ms'] = load * 1000
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if heavy else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Lightweight in-process metrics with Prometheus text export.
+
+Hot-path code records timings with ``span('decode')`` (or ``observe``);
+other modules can register a collector that returns extra gauge values at
+export time. Metrics are exported by
+``render_prometheus()``, a local HTTP endpoint (``SKIN_METRICS_PORT``) or a
+file rewritten periodically (``SKIN_METRICS_FILE``).
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Port of the /metrics endpoint; 0 disables it
+METRICS_PORT = int(os.environ.get('SKIN_METRICS_PORT', 0))
+# File rewritten every METRICS_FILE_INTERVAL seconds; empty disables it
+METRICS_FILE = os.environ.get('SKIN_METRICS_FILE', '')
+METRICS_FILE_INTERVAL = 15
+# Show the metrics panel in the Streamlit sidebar
+DEBUG_METRICS = os.environ.get('SKIN_DEBUG_METRICS', '0') == '1'
+# Sessions seen within this many seconds count as active
+SESSION_TIMEOUT = 300
+
+# Latency buckets in seconds, from sub-millisecond top-k up to slow model loads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+_lock = threading.Lock()
+# name -> (help, {label value: Histogram})
+_histograms = {}
+_collectors = []
+_sessions = {}
+
+
+# Function to record one observation in a histogram keyed by stage
+def observe(name, stage, value, help_text=''):
+    with _lock:
+        family = _histograms.setdefault(name, (help_text, {}))[1]
+        family.setdefault(stage, Histogram()).observe(value)
+
+
+# Context manager that times a block into the per-stage latency histogram
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('skin_stage_seconds', stage, time.perf_counter() - started,
+                'Latency of each stage of the prediction path')
+
+
+# Function to register a callable returning {metric_name: (help, value)} at export time
+def register_collector(collector):
+    """``value`` is a number, or a list of ``(labels dict, number)`` for a labelled gauge."""
+    with _lock:
+        _collectors.append(collector)
+
+
+# Function to mark a session as active
+def touch_session(session_id):
+    with _lock:
+        _sessions[session_id] = time.time()
+
+
+def active_sessions():
+    cutoff = time.time() - SESSION_TIMEOUT
+    with _lock:
+        for session_id in [s for s, seen in _sessions.items() if seen < cutoff]:
+            del _sessions[session_id]
+        return len(_sessions)
+
+
+# Function to snapshot the per-stage latency histogram as {stage: (count, mean seconds)}
+def stage_summary():
+    with _lock:
+        stages = _histograms.get('skin_stage_seconds', ('', {}))[1]
+        return {stage: (h.count, h.sum / h.count if h.count else 0.0)
+                for stage, h in sorted(stages.items())}
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+# Function to render every metric in the Prometheus text exposition format
+def render_prometheus():
+    lines = []
+    with _lock:
+        for name, (help_text, family) in sorted(_histograms.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for stage, h in sorted(family.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum!r}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+        collectors = list(_collectors)
+
+    gauges = {'skin_active_sessions': ('Sessions seen in the last five minutes',
+                                       active_sessions())}
+    for collector in collectors:
+        gauges.update(collector())
+    for name, (help_text, value) in sorted(gauges.items()):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        if isinstance(value, list):
+            for labels, each in value:
+                lines.append(f'{name}{{{_format_labels(labels)}}} {_format_value(each)}')
+        else:
+            lines.append(f'{name} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# Function to write the current metrics to a file, e.g. for node_exporter's textfile collector
+def write_metrics_file(path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_attempted = False
+
+
+# Function to serve /metrics on localhost from a background thread (once per process)
+def start_metrics_server(port=METRICS_PORT, host='127.0.0.1'):
+    global _server, _server_attempted
+    with _lock:
+        if _server_attempted or not port:
+            return _server
+        _server_attempted = True
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            print(f"Metrics endpoint not started on port {port}: {e}", file=sys.stderr)
+            return None
+    threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+    return _server
+
+
+_file_writer = None
+
+
+# Function to rewrite the metrics file periodically from a background thread (once per process)
+def start_metrics_file_writer(path=METRICS_FILE, interval=METRICS_FILE_INTERVAL):
+    global _file_writer
+    with _lock:
+        if _file_writer is not None or not path:
+            return
+        _file_writer = threading.Thread(
+            target=_write_metrics_forever, args=(path, interval),
+            name='metrics-file-writer', daemon=True)
+    _file_writer.start()
+
+
+def _write_metrics_forever(path, interval):
+    while True:
+        try:
+            write_metrics_file(path)
+        except OSError as e:
+            print(f"Could not write metrics to {path}: {e}", file=sys.stderr)
+        time.sleep(interval)
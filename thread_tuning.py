@@ -0,0 +1,231 @@
+"""CPU thread settings for inference, and a command that tunes them.
+
+Usage:
+    python thread_tuning.py autotune [--batch-size 8] [--seconds 10] [--output thread_config.json]
+    python thread_tuning.py show
+
+Three settings control how inference uses the cores of one process:
+
+    intra_op         threads TensorFlow uses inside one op (0 = TF default)
+    inter_op         ops TensorFlow runs in parallel (0 = TF default)
+    inference_slots  forward passes allowed to run at once
+
+They are read from ``thread_config.json`` (``SKIN_THREAD_CONFIG``), and each
+can be overridden with ``SKIN_INTRA_OP_THREADS``, ``SKIN_INTER_OP_THREADS``
+or ``SKIN_INFERENCE_SLOTS``. ``autotune`` runs every candidate in a fresh
+process (TensorFlow fixes its thread pools when it starts), measures
+throughput and latency on the local model, prints the table and writes the
+fastest configuration for the app to load at startup.
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+THREAD_CONFIG_PATH = os.environ.get('SKIN_THREAD_CONFIG', 'thread_config.json')
+DEFAULT_CONFIG = {'intra_op': 0, 'inter_op': 0, 'inference_slots': 1}
+_ENV_OVERRIDES = {'intra_op': 'SKIN_INTRA_OP_THREADS', 'inter_op': 'SKIN_INTER_OP_THREADS',
+                  'inference_slots': 'SKIN_INFERENCE_SLOTS'}
+
+
+# Function to read the thread settings from the config file and environment
+def load_thread_config(path=THREAD_CONFIG_PATH):
+    config = dict(DEFAULT_CONFIG)
+    if path and os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        config.update({key: int(saved[key]) for key in DEFAULT_CONFIG if key in saved})
+    for key, env in _ENV_OVERRIDES.items():
+        if os.environ.get(env):
+            config[key] = int(os.environ[env])
+    config['inference_slots'] = max(1, config['inference_slots'])
+    return config
+
+
+_config = None
+_config_lock = threading.Lock()
+_slots = None
+
+
+# Function to get the process-wide thread settings, applying them to TensorFlow once
+def get_thread_config():
+    global _config, _slots
+    with _config_lock:
+        if _config is None:
+            _config = load_thread_config()
+            _slots = threading.BoundedSemaphore(_config['inference_slots'])
+            apply_thread_config(_config)
+        return _config
+
+
+# Function to set TensorFlow's thread pools; only takes effect before TF starts its runtime
+def apply_thread_config(config):
+    if not config['intra_op'] and not config['inter_op']:
+        return
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(config['intra_op'])
+        tf.config.threading.set_inter_op_parallelism_threads(config['inter_op'])
+    except RuntimeError as e:
+        print(f"Thread settings not applied, TensorFlow already started: {e}", file=sys.stderr)
+
+
+# Context manager that holds one of the process's inference slots
+@contextmanager
+def inference_slot():
+    get_thread_config()
+    with _slots:
+        yield
+
+
+# Function to list (intra_op, inter_op, slots) candidates for this machine
+def default_candidates(cores=None):
+    cores = cores or os.cpu_count()
+    candidates = [(0, 0, 1)]
+    slots = 1
+    while slots <= cores:
+        per_slot = cores // slots
+        for intra_op in sorted({per_slot, max(1, per_slot // 2)}):
+            for inter_op in (1, 2):
+                candidates.append((intra_op, inter_op, slots))
+        slots *= 2
+    return candidates
+
+
+# Function to time concurrent forward passes with the current process's settings
+def measure(batch_size, seconds, stand_in=False):
+    from model_loader import INPUT_SHAPE, MODEL_WEIGHTS_PATH, build_stand_in_model, load_model
+
+    config = get_thread_config()
+    if not stand_in and os.path.exists(MODEL_WEIGHTS_PATH):
+        model = load_model()
+    else:
+        model = build_stand_in_model()
+    batch = np.random.default_rng(0).random((batch_size,) + INPUT_SHAPE, dtype=np.float32)
+    model.predict_on_batch(batch)
+
+    latencies = []
+    latencies_lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            model.predict_on_batch(batch)
+            with latencies_lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(config['inference_slots'])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = np.array(latencies) * 1000.0
+    return dict(config, batch_size=batch_size,
+                images_per_sec=len(latencies) * batch_size / elapsed,
+                p50_ms=float(np.percentile(latencies_ms, 50)),
+                p95_ms=float(np.percentile(latencies_ms, 95)))
+
+
+def _run_candidate(intra_op, inter_op, slots, args):
+    env = dict(os.environ, SKIN_INTRA_OP_THREADS=str(intra_op),
+               SKIN_INTER_OP_THREADS=str(inter_op), SKIN_INFERENCE_SLOTS=str(slots),
+               SKIN_THREAD_CONFIG='')
+    command = [sys.executable, os.path.abspath(__file__), 'measure',
+               '--batch-size', str(args.batch_size), '--seconds', str(args.seconds)]
+    if args.stand_in:
+        command.append('--stand-in')
+    proc = subprocess.run(command, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def _autotune(args):
+    if args.intra or args.inter or args.slots:
+        candidates = list(itertools.product(args.intra or [0], args.inter or [0],
+                                            args.slots or [1]))
+    else:
+        candidates = default_candidates()
+
+    results = []
+    print(f"{'intra':>5s} {'inter':>5s} {'slots':>5s} {'img/s':>9s} {'p50 ms':>9s} {'p95 ms':>9s}")
+    for intra_op, inter_op, slots in candidates:
+        result = _run_candidate(intra_op, inter_op, slots, args)
+        if result is None:
+            print(f"{intra_op:5d} {inter_op:5d} {slots:5d}    failed")
+            continue
+        results.append(result)
+        print(f"{intra_op:5d} {inter_op:5d} {slots:5d} {result['images_per_sec']:9.1f} "
+              f"{result['p50_ms']:9.1f} {result['p95_ms']:9.1f}")
+
+    eligible = [r for r in results if not args.max_p95_ms or r['p95_ms'] <= args.max_p95_ms]
+    if not eligible:
+        sys.exit("No configuration met the latency limit")
+    best = max(eligible, key=lambda r: r['images_per_sec'])
+    with open(args.output, 'w') as f:
+        json.dump({key: best[key] for key in DEFAULT_CONFIG}, f, indent=2)
+    print(f"Best: intra_op={best['intra_op']} inter_op={best['inter_op']} "
+          f"inference_slots={best['inference_slots']} ({best['images_per_sec']:.1f} img/s); "
+          f"wrote {args.output}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'cpu_count': os.cpu_count(), 'results': results, 'best': best}, f,
+                      indent=2)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    autotune = commands.add_parser('autotune', help='sweep thread settings and save the best')
+    autotune.add_argument('--batch-size', type=int, default=8,
+                          help='images per forward pass, e.g. the usual scheduler batch')
+    autotune.add_argument('--seconds', type=float, default=10,
+                          help='measurement time per configuration')
+    autotune.add_argument('--intra', type=_int_list, help='comma-separated intra_op values')
+    autotune.add_argument('--inter', type=_int_list, help='comma-separated inter_op values')
+    autotune.add_argument('--slots', type=_int_list, help='comma-separated slot counts')
+    autotune.add_argument('--max-p95-ms', type=float,
+                          help='ignore configurations slower than this at p95')
+    autotune.add_argument('--stand-in', action='store_true',
+                          help='use the stand-in model even if model.h5 exists')
+    autotune.add_argument('--output', default=THREAD_CONFIG_PATH)
+    autotune.add_argument('--report', help='also write every measurement to this JSON file')
+
+    measure_parser = commands.add_parser('measure', help=argparse.SUPPRESS)
+    measure_parser.add_argument('--batch-size', type=int, default=8)
+    measure_parser.add_argument('--seconds', type=float, default=10)
+    measure_parser.add_argument('--stand-in', action='store_true')
+
+    commands.add_parser('show', help='print the settings this process would use')
+    args = parser.parse_args()
+
+    if args.command == 'autotune':
+        return _autotune(args)
+    if args.command == 'measure':
+        print(json.dumps(measure(args.batch_size, args.seconds, args.stand_in)))
+        return 0
+    print(json.dumps(load_thread_config(), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import sys
+import threading
+
+
+# Path for the Excel file that used to store user data
+USER_DATA_PATH = os.environ.get(
+    'SKIN_USER_DATA', r'F:\Skin-LesionDetection-main\Skin\Skin\user_data.xlsx')
+# Path for the SQLite database that stores user data
+USER_DB_PATH = os.environ.get(
+    'SKIN_USER_DB', r'F:\Skin-LesionDetection-main\Skin\Skin\user_data.sqlite3')
+# Which backend get_user_store() returns: 'sqlite' or 'excel'
+USER_STORE_BACKEND = os.environ.get('SKIN_USER_STORE', 'sqlite')
+
+USER_COLUMNS = ['email', 'name', 'password']
+
+
+class UserStore:
+    """Interface of a user-account backend.
+
+    ``get_user`` returns a dict with ``USER_COLUMNS`` keys or ``None``.
+    ``add_user`` returns ``False`` instead of overwriting an existing email.
+    """
+
+    def get_user(self, email):
+        raise NotImplementedError
+
+    def add_user(self, email, name, password):
+        raise NotImplementedError
+
+    def all_users(self):
+        raise NotImplementedError
+
+
+class SQLiteUserStore(UserStore):
+    """User store backed by a SQLite table with the email as primary key."""
+
+    def __init__(self, db_path=USER_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS users ('
+                'email TEXT PRIMARY KEY, name TEXT NOT NULL, password TEXT NOT NULL)')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    # Streamlit runs each session on its own thread, so keep one connection per thread
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def get_user(self, email):
+        row = self._connection().execute(
+            'SELECT email, name, password FROM users WHERE email = ?', (email,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def add_user(self, email, name, password):
+        try:
+            with self._connection() as db:
+                db.execute('INSERT INTO users (email, name, password) VALUES (?, ?, ?)',
+                           (email, name, password))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def all_users(self):
+        rows = self._connection().execute('SELECT email, name, password FROM users')
+        return [dict(row) for row in rows]
+
+    def migrate_from_excel(self, excel_path=USER_DATA_PATH):
+        """Import accounts from the legacy Excel file once.
+
+        Returns the number of users imported. Later calls are no-ops, and
+        emails that already exist in the database are left untouched.
+        """
+        db = self._connection()
+        migrated = "SELECT 1 FROM meta WHERE key = 'excel_migrated'"
+        if db.execute(migrated).fetchone():
+            return 0
+        users = ExcelUserStore(excel_path).all_users() if os.path.exists(excel_path) else []
+        with db:
+            # Check again under the write lock: another process may have migrated meanwhile
+            db.execute('BEGIN IMMEDIATE')
+            if db.execute(migrated).fetchone():
+                return 0
+            before = db.total_changes
+            db.executemany(
+                'INSERT OR IGNORE INTO users (email, name, password) VALUES (?, ?, ?)',
+                [(u['email'], u['name'], u['password']) for u in users])
+            imported = db.total_changes - before
+            db.execute("INSERT INTO meta (key, value) VALUES ('excel_migrated', ?)",
+                       (excel_path,))
+        return imported
+
+
+class ExcelUserStore(UserStore):
+    """Legacy store that keeps every account in a single .xlsx file.
+
+    Each insert rewrites the whole workbook and is not safe against
+    concurrent sign-ups; it is kept for reading old data and for setups that
+    still need the spreadsheet.
+    """
+
+    def __init__(self, excel_path=USER_DATA_PATH):
+        self.excel_path = excel_path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        import pandas as pd
+        if os.path.exists(self.excel_path):
+            return pd.read_excel(self.excel_path, dtype=str).fillna('')
+        return pd.DataFrame(columns=USER_COLUMNS)
+
+    def get_user(self, email):
+        user_data = self._load()
+        match = user_data[user_data['email'] == email]
+        return match.iloc[0][USER_COLUMNS].to_dict() if len(match) else None
+
+    def add_user(self, email, name, password):
+        import pandas as pd
+        with self._lock:
+            user_data = self._load()
+            if email in user_data['email'].values:
+                return False
+            new_user = pd.DataFrame([[email, name, password]], columns=USER_COLUMNS)
+            user_data = pd.concat([user_data, new_user], ignore_index=True)
+            user_data.to_excel(self.excel_path, index=False)
+        return True
+
+    def all_users(self):
+        return self._load()[USER_COLUMNS].to_dict('records')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Function to get the configured user store, migrating Excel data on first use
+def get_user_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if USER_STORE_BACKEND == 'excel':
+                _store = ExcelUserStore()
+            else:
+                _store = SQLiteUserStore()
+                _store.migrate_from_excel()
+        return _store
+
+
+if __name__ == '__main__':
+    # python user_store.py [excel_path] [db_path]
+    excel_path = sys.argv[1] if len(sys.argv) > 1 else USER_DATA_PATH
+    db_path = sys.argv[2] if len(sys.argv) > 2 else USER_DB_PATH
+    imported = SQLiteUserStore(db_path).migrate_from_excel(excel_path)
+    print(f"Imported {imported} users from {excel_path} into {db_path}")